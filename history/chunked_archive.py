@@ -0,0 +1,201 @@
+import json
+import lzma
+import queue
+import struct
+import threading
+import zlib
+from functools import lru_cache
+from itertools import product
+import numpy as np
+
+# Magic bytes at the start and end of an archive file
+MAGIC = b'THSARCH1'
+# Footer: offset of the JSON header (little-endian uint64) followed by the magic bytes
+FOOTER = struct.Struct('<Q8s')
+
+# Compression codecs as (compress(data, level), decompress(data)) pairs
+COMPRESSORS = {
+    'zlib': (lambda data, level: zlib.compress(data, level), zlib.decompress),
+    'lzma': (lambda data, level: lzma.compress(data, preset=level), lzma.decompress),
+}
+
+
+class ChunkedArchiveWriter:
+    """
+    The ChunkedArchiveWriter class writes the states of a cube into a compressed, self-describing archive file.
+
+    States are grouped into chunks over (time, x, y, z) and every chunk is compressed on its own, so that any frame can
+    be read back without decompressing the whole run. Compression and writing happen on a background thread, which
+    overlaps them with the simulation. The file ends with a JSON header holding the shape, the chunk index and any
+    metadata (such as the propagator and heat_conductor parameters). It has an append() method, so it can be passed
+    to Propagator.propagate() as the history.
+
+    :param filename: Path of the archive file to write.
+    :param shape: The shape of a single state.
+    :param chunk_shape: The shape of a chunk as (time, x, y, z).
+    :param metadata: Optional dictionary of JSON-serializable values stored in the header.
+    :param compression: The compression codec, 'zlib' (fast) or 'lzma' (smaller).
+    :param level: The compression level passed to the codec.
+    :param dtype: The numpy data type the states are stored as.
+    """
+
+    def __init__(self, filename, shape, chunk_shape=(16, 16, 16, 16), metadata=None, compression='zlib', level=6,
+                 dtype=np.float64):
+        if compression not in COMPRESSORS:
+            raise ValueError(f"Unknown compression '{compression}', expected one of {tuple(COMPRESSORS)}")
+        if len(chunk_shape) != len(shape) + 1:
+            raise ValueError("chunk_shape must have one time axis followed by the axes of a state")
+        self.filename = filename
+        self.shape = tuple(shape)
+        self.chunk_shape = tuple(chunk_shape)
+        self.metadata = metadata or {}
+        self.compression = compression
+        self.level = level
+        self.dtype = np.dtype(dtype)
+        self.length = 0
+        self.index = []
+        self.buffer = np.empty((self.chunk_shape[0], *self.shape), dtype=self.dtype)
+        self.buffered = 0
+        # Corner and spatial slices of every chunk within a time chunk
+        self.blocks = [(corner, tuple(slice(c, c + step) for c, step in zip(corner, self.chunk_shape[1:])))
+                       for corner in product(*(range(0, size, step)
+                                               for size, step in zip(self.shape, self.chunk_shape[1:])))]
+
+        self.file = open(filename, 'wb')
+        self.file.write(MAGIC)
+        # Bounded so that the simulation waits for the writer instead of buffering the whole run
+        self.pending = queue.Queue(maxsize=4)
+        self.error = None
+        self.worker = threading.Thread(target=self._write_chunks, daemon=True)
+        self.worker.start()
+
+    def append(self, state):
+        """
+        Adds a state to the archive. It is compressed and written once its time chunk is full.
+
+        :param state: A numpy array with the shape given to the writer.
+        """
+        if self.error is not None:
+            raise self.error
+        self.buffer[self.buffered] = state
+        self.buffered += 1
+        self.length += 1
+        if self.buffered == len(self.buffer):
+            self._submit()
+
+    def __len__(self):
+        return self.length
+
+    def close(self):
+        """
+        Writes the remaining states, the chunk index and the header, then closes the file.
+        """
+        if self.buffered:
+            self._submit()
+        self.pending.put(None)
+        self.worker.join()
+        if self.error is not None:
+            raise self.error
+
+        header = {
+            'shape': [self.length, *self.shape],
+            'dtype': self.dtype.str,
+            'chunk_shape': list(self.chunk_shape),
+            'compression': self.compression,
+            'metadata': self.metadata,
+            'chunks': self.index,
+        }
+        header_offset = self.file.tell()
+        self.file.write(json.dumps(header).encode())
+        self.file.write(FOOTER.pack(header_offset, MAGIC))
+        self.file.close()
+
+    def _submit(self):
+        # Hand a copy of the buffered time chunk to the writer thread
+        self.pending.put((self.length - self.buffered, self.buffer[:self.buffered].copy()))
+        self.buffered = 0
+
+    def _write_chunks(self):
+        compress = COMPRESSORS[self.compression][0]
+        while True:
+            item = self.pending.get()
+            if item is None:
+                return
+            if self.error is not None:
+                continue
+            try:
+                start, frames = item
+                for corner, slices in self.blocks:
+                    data = compress(np.ascontiguousarray(frames[(slice(None), *slices)]).tobytes(), self.level)
+                    self.index.append([start, *corner, self.file.tell(), len(data)])
+                    self.file.write(data)
+            except Exception as error:
+                self.error = error
+
+
+class ChunkedArchive:
+    """
+    The ChunkedArchive class reads an archive written by ChunkedArchiveWriter.
+
+    A frame is rebuilt by decompressing only the chunks that cover it, found through the chunk index, and the most
+    recently used chunks are cached. The class supports len(), iteration, indexing and slicing, so it can be passed to
+    Animator in place of a list. The header metadata is available as the metadata attribute.
+
+    :param filename: Path of the archive file to read.
+    :param cache_size: The number of decompressed chunks to keep in memory.
+    """
+
+    def __init__(self, filename, cache_size=64):
+        self.file = open(filename, 'rb')
+        if self.file.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{filename} is not a simulation archive")
+        self.file.seek(-FOOTER.size, 2)
+        footer_offset = self.file.tell()
+        header_offset, magic = FOOTER.unpack(self.file.read(FOOTER.size))
+        if magic != MAGIC:
+            raise ValueError(f"{filename} is incomplete, the archive was not closed")
+        self.file.seek(header_offset)
+        header = json.loads(self.file.read(footer_offset - header_offset))
+
+        self.shape = tuple(header['shape'])
+        self.dtype = np.dtype(header['dtype'])
+        self.chunk_shape = tuple(header['chunk_shape'])
+        self.metadata = header['metadata']
+        self.decompress = COMPRESSORS[header['compression']][1]
+        # Chunk locations grouped by the first frame of their time chunk
+        self.chunks = {}
+        for start, *corner, offset, length in header['chunks']:
+            self.chunks.setdefault(start, []).append((tuple(corner), offset, length))
+        self._read_chunk = lru_cache(maxsize=cache_size)(self._read_chunk)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("archive index out of range")
+
+        start = index - index % self.chunk_shape[0]
+        frame = np.empty(self.shape[1:], dtype=self.dtype)
+        for corner, offset, length in self.chunks[start]:
+            block = self._read_chunk(start, corner, offset, length)
+            frame[tuple(slice(c, c + size) for c, size in zip(corner, block.shape[1:]))] = block[index - start]
+        return frame
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def close(self):
+        self.file.close()
+
+    def _read_chunk(self, start, corner, offset, length):
+        frames = min(self.chunk_shape[0], len(self) - start)
+        block_shape = [min(step, size - c) for c, step, size in zip(corner, self.chunk_shape[1:], self.shape[1:])]
+        self.file.seek(offset)
+        data = self.decompress(self.file.read(length))
+        return np.frombuffer(data, dtype=self.dtype).reshape(frames, *block_shape)
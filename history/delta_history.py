@@ -0,0 +1,85 @@
+import numpy as np
+
+
+class DeltaHistory:
+    """
+    The DeltaHistory class stores the states of a cube as full keyframes every keyframe_interval states, and as sparse
+    deltas (flat index, value) of the cells that changed in between.
+
+    Consecutive states of the queue engine differ in only a few cells, so this takes a fraction of the memory of a
+    list of full copies. It supports append(), len(), iteration, indexing and slicing, so it can be passed to
+    Propagator.propagate() and Animator in place of a list. A state is rebuilt from the nearest earlier keyframe.
+
+    :param keyframe_interval: The number of states between full keyframes.
+    """
+
+    def __init__(self, keyframe_interval=100):
+        if keyframe_interval < 1:
+            raise ValueError("keyframe_interval must be at least 1")
+        self.keyframe_interval = keyframe_interval
+        self.keyframes = []
+        # One (flat indices, values) pair per state, None for keyframes
+        self.deltas = []
+        self.last_state = None
+
+    def append(self, state):
+        """
+        Adds a state to the history.
+
+        :param state: A numpy array with the same shape as the previous states.
+        """
+        if len(self.deltas) % self.keyframe_interval == 0:
+            self.keyframes.append(np.array(state, copy=True))
+            self.deltas.append(None)
+        else:
+            changed = np.flatnonzero(state != self.last_state)
+            index_type = np.int32 if state.size < np.iinfo(np.int32).max else np.int64
+            if changed.size * (np.dtype(index_type).itemsize + state.itemsize) < state.nbytes:
+                self.deltas.append((changed.astype(index_type), state.ravel()[changed]))
+            else:
+                # Most cells changed, so storing every value is smaller than a sparse delta
+                self.deltas.append((slice(None), state.ravel().copy()))
+        self.last_state = np.array(state, copy=True)
+
+    def __len__(self):
+        return len(self.deltas)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("history index out of range")
+
+        keyframe = index // self.keyframe_interval
+        state = self.keyframes[keyframe].copy()
+        flat = state.reshape(-1)
+        for changed, values in self.deltas[keyframe * self.keyframe_interval + 1:index + 1]:
+            flat[changed] = values
+        return state
+
+    def __iter__(self):
+        # Apply the deltas in order rather than rebuilding every state from its keyframe
+        state = None
+        for index, delta in enumerate(self.deltas):
+            if delta is None:
+                state = self.keyframes[index // self.keyframe_interval].copy()
+            else:
+                state = state.copy()
+                changed, values = delta
+                state.reshape(-1)[changed] = values
+            yield state
+
+    @property
+    def nbytes(self):
+        """
+        :return: The number of bytes used by the stored keyframes and deltas.
+        """
+        keyframe_bytes = sum(keyframe.nbytes for keyframe in self.keyframes)
+        delta_bytes = 0
+        for changed, values in filter(None, self.deltas):
+            if isinstance(changed, np.ndarray):
+                delta_bytes += changed.nbytes
+            delta_bytes += values.nbytes
+        return keyframe_bytes + delta_bytes
@@ -0,0 +1,88 @@
+import os
+import numpy as np
+
+
+class MemmapHistoryWriter:
+    """
+    The MemmapHistoryWriter class writes the states of a cube into a preallocated, memory-mapped .npy file, so that
+    runs whose history does not fit in memory can still be recorded.
+
+    The file is created up front with room for frame_count states and flushed to disk every flush_every states. If
+    fewer states are written, close() shrinks the file to the states actually recorded. It has an append() method, so
+    it can be passed to Propagator.propagate() as the history.
+
+    :param filename: Path of the .npy file to write.
+    :param frame_count: The maximum number of states the file can hold, see Propagator.max_frames().
+    :param shape: The shape of a single state.
+    :param dtype: The numpy data type the states are stored as.
+    :param flush_every: The number of states written between flushes to disk.
+    """
+
+    def __init__(self, filename, frame_count, shape, dtype=np.float64, flush_every=100):
+        self.filename = filename
+        self.flush_every = flush_every
+        self.frames = np.lib.format.open_memmap(filename, mode='w+', dtype=dtype, shape=(frame_count, *shape))
+        self.length = 0
+
+    def append(self, state):
+        """
+        Writes a state into the next frame of the file.
+
+        :param state: A numpy array with the shape given to the writer.
+        """
+        if self.length == len(self.frames):
+            raise IndexError(f"history file {self.filename} is full ({len(self.frames)} frames)")
+        self.frames[self.length] = state
+        self.length += 1
+        if self.length % self.flush_every == 0:
+            self.frames.flush()
+
+    def __len__(self):
+        return self.length
+
+    def close(self):
+        """
+        Flushes the remaining states to disk and shrinks the file to the number of states written.
+        """
+        self.frames.flush()
+        shape = (self.length, *self.frames.shape[1:])
+        dtype = self.frames.dtype
+        frame_bytes = self.frames[0].nbytes if len(self.frames) else 0
+        del self.frames
+
+        with open(self.filename, 'r+b') as file:
+            version = np.lib.format.read_magic(file)
+            header = {'descr': np.lib.format.dtype_to_descr(dtype), 'fortran_order': False, 'shape': shape}
+            file.seek(0)
+            # The .npy header leaves room to rewrite the length of the first axis in place
+            if version == (1, 0):
+                np.lib.format.write_array_header_1_0(file, header)
+            else:
+                np.lib.format.write_array_header_2_0(file, header)
+            file.truncate(file.tell() + self.length * frame_bytes)
+
+
+class MemmapHistory:
+    """
+    The MemmapHistory class reads the states written by MemmapHistoryWriter without loading the file into memory.
+
+    Indexing returns zero-copy, read-only views into the memory-mapped file, and the class supports len(), iteration
+    and slicing, so it can be passed to Animator in place of a list.
+
+    :param filename: Path of the .npy file to read.
+    """
+
+    def __init__(self, filename):
+        if not os.path.exists(filename):
+            raise FileNotFoundError(f"history file {filename} does not exist")
+        self.filename = filename
+        self.frames = np.load(filename, mmap_mode='r')
+
+    def __len__(self):
+        return len(self.frames)
+
+    def __getitem__(self, index):
+        return self.frames[index]
+
+    def __iter__(self):
+        return iter(self.frames)
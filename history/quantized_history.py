@@ -0,0 +1,80 @@
+import numpy as np
+
+# Largest code a uint16 can hold
+MAX_CODE = np.iinfo(np.uint16).max
+
+
+class QuantizedHistory:
+    """
+    The QuantizedHistory class stores the states of a cube as uint16 offsets from start_value in steps of resolution,
+    a quarter of the memory of float64 states.
+
+    Temperatures outside [start_value, start_value + resolution * 65535] are clipped to that range. States are only
+    converted back to temperatures when they are accessed. The class supports append(), len(), iteration, indexing
+    and slicing, so it can be passed to Propagator.propagate() and Animator in place of a list.
+
+    :param start_value: The temperature stored as code 0 (K).
+    :param end_value: The highest temperature expected in the states (K).
+    :param resolution: The temperature step between codes (K). By default the 65536 codes are spread evenly over
+                       [start_value, end_value].
+    """
+
+    def __init__(self, start_value, end_value, resolution=None):
+        if end_value <= start_value:
+            raise ValueError("end_value must be greater than start_value")
+        if resolution is None:
+            resolution = (end_value - start_value) / MAX_CODE
+        # Allow for rounding in the division, which can put the default resolution a hair below the exact step
+        elif np.ceil((end_value - start_value) / resolution - 1E-9) > MAX_CODE:
+            raise ValueError(f"resolution {resolution} is too fine to cover [{start_value}, {end_value}] in uint16")
+        self.start_value = start_value
+        self.end_value = end_value
+        self.resolution = resolution
+        self.states = []
+
+    def append(self, state):
+        """
+        Quantizes a state and adds it to the history.
+
+        :param state: A numpy array of temperatures (K).
+        """
+        codes = np.rint((np.asarray(state) - self.start_value) / self.resolution)
+        self.states.append(np.clip(codes, 0, MAX_CODE).astype(np.uint16))
+
+    def __len__(self):
+        return len(self.states)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        return self.start_value + self.states[index] * self.resolution
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def codes(self, index):
+        """
+        :param index: The index of a state.
+        :return: The raw uint16 codes of the state, without converting them back to temperatures.
+        """
+        return self.states[index]
+
+    def color_indices(self, index, colors):
+        """
+        Maps a state onto the entries of a colormap lookup table straight from its codes, with the colormap spanning
+        [start_value, end_value].
+
+        :param index: The index of a state.
+        :param colors: The number of entries in the colormap.
+        :return: An integer array of colormap indices.
+        """
+        top = int(round((self.end_value - self.start_value) / self.resolution))
+        return np.minimum(self.states[index].astype(np.int64) * colors // (top + 1), colors - 1)
+
+    @property
+    def nbytes(self):
+        """
+        :return: The number of bytes used by the stored codes.
+        """
+        return sum(state.nbytes for state in self.states)
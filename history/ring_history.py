@@ -0,0 +1,87 @@
+import numpy as np
+
+
+class RingHistory:
+    """
+    The RingHistory class keeps the most recent states of a cube in a preallocated ring buffer, plus a keyframe every
+    keyframe_interval states across the whole run, so its memory is fixed up front however long the run is.
+
+    The states it holds are indexed in the order they were appended: first the keyframes older than the window, then
+    the states in the window. When every keyframe slot is in use, every other keyframe is dropped and the keyframe
+    interval doubles, which keeps an evenly spaced overview of the whole run. The class supports append(), len(),
+    iteration, indexing and slicing, so it can be passed to Propagator.propagate() and Animator in place of a list.
+
+    :param shape: The shape of each state.
+    :param window: The number of most recent states to keep.
+    :param keyframe_interval: The number of states between keyframes.
+    :param max_keyframes: The number of keyframe slots.
+    :param dtype: The numpy data type of the stored states.
+    """
+
+    def __init__(self, shape, window=300, keyframe_interval=100, max_keyframes=100, dtype=np.float64):
+        if window < 1 or keyframe_interval < 1 or max_keyframes < 2:
+            raise ValueError("window and keyframe_interval must be at least 1 and max_keyframes at least 2")
+        self.window = window
+        self.keyframe_interval = keyframe_interval
+        self.ring = np.empty((window,) + tuple(shape), dtype=dtype)
+        self.keyframes = np.empty((max_keyframes,) + tuple(shape), dtype=dtype)
+        # Number of the appended state held in each used keyframe slot
+        self.keyframe_indices = []
+        self.count = 0
+
+    def append(self, state):
+        """
+        Adds a state to the ring buffer, overwriting the oldest one, and keeps it as a keyframe if it falls on the
+        keyframe interval.
+
+        :param state: A numpy array with the given shape.
+        """
+        if self.count % self.keyframe_interval == 0:
+            if len(self.keyframe_indices) == len(self.keyframes):
+                # Drop every other keyframe to make room, keeping them evenly spaced
+                kept = len(self.keyframes[::2])
+                self.keyframes[:kept] = self.keyframes[::2]
+                self.keyframe_indices = self.keyframe_indices[::2]
+                self.keyframe_interval *= 2
+            if self.count % self.keyframe_interval == 0:
+                self.keyframes[len(self.keyframe_indices)] = state
+                self.keyframe_indices.append(self.count)
+        self.ring[self.count % self.window] = state
+        self.count += 1
+
+    def indices(self):
+        """
+        :return: The number of the appended state behind each index of the history, for instance to select their
+                 times from Propagator.frame_times.
+        """
+        window_start = max(0, self.count - self.window)
+        keyframe_indices = [index for index in self.keyframe_indices if index < window_start]
+        return keyframe_indices + list(range(window_start, self.count))
+
+    def __len__(self):
+        window_start = max(0, self.count - self.window)
+        return sum(index < window_start for index in self.keyframe_indices) + self.count - window_start
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        length = len(self)
+        if index < 0:
+            index += length
+        if not 0 <= index < length:
+            raise IndexError("history index out of range")
+        keyframes = length - min(self.count, self.window)
+        if index < keyframes:
+            return self.keyframes[index]
+        return self.ring[(self.count - length + index) % self.window]
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    @property
+    def nbytes(self):
+        """
+        :return: The number of bytes preallocated for the ring buffer and the keyframes.
+        """
+        return self.ring.nbytes + self.keyframes.nbytes
@@ -1,6 +1,12 @@
+import numpy as np
 from utils.config_loader import load_config
 from simulation.heat_conductor import HeatConductor
 from simulation.propagator import Propagator
+from history.chunked_archive import ChunkedArchive, ChunkedArchiveWriter
+from history.delta_history import DeltaHistory
+from history.memmap_history import MemmapHistoryWriter
+from history.quantized_history import QuantizedHistory
+from history.ring_history import RingHistory
 from visualization.animator import Animator
 
 CONFIG_PATH = "config.yaml"
@@ -8,6 +14,8 @@ CONFIG_PATH = "config.yaml"
 config = load_config(CONFIG_PATH)
 
 cube_size = int(config['propagator']['cube_size'])
+# Cells along each axis, cube_size unless set
+shape = tuple(int(config['propagator'].get(name) or cube_size) for name in ('nx', 'ny', 'nz'))
 origin = tuple(config['propagator']['origin'])
 start_temp = float(config['propagator']['start_temp'])
 end_temp = float(config['propagator']['end_temp'])
@@ -15,19 +23,120 @@ increment = float(config['propagator']['increment'])
 delay = int(config['propagator']['delay'])
 max_iterations = int(float(config['propagator']['max_iterations']))
 delta_tolerance = float(config['propagator']['delta_tolerance'])
+engine = str(config['propagator'].get('engine', 'queue'))
+max_waves = config['propagator'].get('max_waves')
+max_waves = int(max_waves) if max_waves is not None else None
+verify_interval = int(config['propagator'].get('verify_interval', 1000))
+record_every = int(config['propagator'].get('record_every', 1))
+record_frames = config['propagator'].get('record_frames')
+record_frames = int(record_frames) if record_frames is not None else None
+record_threshold = config['propagator'].get('record_threshold')
+record_threshold = float(record_threshold) if record_threshold is not None else None
+implicit_scheme = str(config['propagator'].get('implicit_scheme', 'backward_euler'))
+solver_tolerance = float(config['propagator'].get('solver_tolerance', 1E-8))
+solver_max_iterations = int(float(config['propagator'].get('solver_max_iterations', 500)))
+adaptive = bool(config['propagator'].get('adaptive', False))
+error_tolerance = float(config['propagator'].get('error_tolerance', 1.0))
+min_time_step = config['propagator'].get('min_time_step')
+min_time_step = float(min_time_step) if min_time_step is not None else None
+max_time_step = config['propagator'].get('max_time_step')
+max_time_step = float(max_time_step) if max_time_step is not None else None
+steady_state = bool(config['propagator'].get('steady_state', False))
+state_times = config['propagator'].get('state_times')
+state_times = [float(time) for time in state_times] if state_times is not None else None
+modes = int(config['propagator'].get('modes', 64))
+modal_cache = config['propagator'].get('modal_cache')
+krylov_dimension = int(config['propagator'].get('krylov_dimension', 30))
+mask_file = config['propagator'].get('mask')
+mask = np.load(mask_file).astype(bool) if mask_file is not None else None
+operator_cache = config['propagator'].get('operator_cache')
+history_type = str(config['history']['type'])
+keyframe_interval = int(config['history']['keyframe_interval'])
+history_filename = str(config['history']['filename'])
+history_dtype = str(config['history']['dtype'])
+flush_every = int(config['history']['flush_every'])
+archive_filename = str(config['history']['archive_filename'])
+chunk_shape = tuple(config['history']['chunk_shape'])
+compression = str(config['history']['compression'])
+compression_level = int(config['history']['compression_level'])
+resolution = config['history']['resolution']
+resolution = float(resolution) if resolution is not None else None
+window = int(config['history'].get('window', 300))
+max_keyframes = int(config['history'].get('max_keyframes', 100))
 k = float(config['heat_conductor']['k'])
 c_p = float(config['heat_conductor']['c_p'])
 rho = float(config['heat_conductor']['rho'])
 min_delta = float(config['heat_conductor']['min_delta'])
 conduction_time = float(config['heat_conductor']['conduction_time'])
 delta_x = float(config['heat_conductor']['delta_x'])
+delta_y = config['heat_conductor'].get('delta_y')
+delta_y = float(delta_y) if delta_y is not None else None
+delta_z = config['heat_conductor'].get('delta_z')
+delta_z = float(delta_z) if delta_z is not None else None
 a = float(config['heat_conductor']['a'])
+materials_file = config['heat_conductor'].get('materials')
+materials = np.load(materials_file) if materials_file is not None else None
+material_table = config['heat_conductor'].get('material_table')
+k_curve = config['heat_conductor'].get('k_curve')
+c_p_curve = config['heat_conductor'].get('c_p_curve')
+table_size = int(config['heat_conductor'].get('table_size', 1024))
 
 if __name__ == "__main__":
-    h = HeatConductor(k=k, c_p=c_p, rho=rho, min_delta=min_delta, conduction_time=conduction_time, delta_x=delta_x, a=a)
-    p = Propagator(cube_size=cube_size, origin=origin, start_temp=start_temp, end_temp=end_temp, increment=increment,
-                   delay=delay, max_iterations=max_iterations, delta_tolerance=delta_tolerance, heat_conductor=h)
-    cube_data = p.propagate()
+    h = HeatConductor(k=k, c_p=c_p, rho=rho, min_delta=min_delta, conduction_time=conduction_time, delta_x=delta_x, a=a,
+                      materials=materials, material_table=material_table, k_curve=k_curve, c_p_curve=c_p_curve,
+                      table_range=(start_temp, end_temp), table_size=table_size, delta_y=delta_y, delta_z=delta_z)
+    p = Propagator(cube_size=shape, origin=origin, start_temp=start_temp, end_temp=end_temp, increment=increment,
+                   delay=delay, max_iterations=max_iterations, delta_tolerance=delta_tolerance, heat_conductor=h,
+                   engine=engine, max_waves=max_waves, verify_interval=verify_interval,
+                   record_every=record_every, record_frames=record_frames, record_threshold=record_threshold,
+                   implicit_scheme=implicit_scheme, solver_tolerance=solver_tolerance,
+                   solver_max_iterations=solver_max_iterations, adaptive=adaptive, error_tolerance=error_tolerance,
+                   min_time_step=min_time_step, max_time_step=max_time_step, modes=modes, modal_cache=modal_cache,
+                   krylov_dimension=krylov_dimension, mask=mask, operator_cache=operator_cache)
 
-    a = Animator(cube_data, start_value=start_temp, end_value=end_temp)
-    a.plot()
+    if steady_state:
+        cube, diagnostics = p.solve_steady_state()
+        print("Steady state residual: ")
+        print(diagnostics['residual'])
+        Animator([cube], start_value=start_temp, end_value=end_temp, spacing=h.spacing).plot()
+    elif state_times is not None:
+        cube_data = p.states_at(state_times)
+        Animator(cube_data, start_value=start_temp, end_value=end_temp, times=p.frame_times,
+                 spacing=h.spacing).plot()
+    else:
+        if history_type == 'delta':
+            history = DeltaHistory(keyframe_interval=keyframe_interval)
+        elif history_type == 'memmap':
+            history = MemmapHistoryWriter(history_filename, frame_count=p.max_frames(),
+                                          shape=shape, dtype=history_dtype,
+                                          flush_every=flush_every)
+        elif history_type == 'archive':
+            history = ChunkedArchiveWriter(archive_filename, shape=shape,
+                                           chunk_shape=chunk_shape, compression=compression, level=compression_level,
+                                           metadata={'propagator': config['propagator'],
+                                                     'heat_conductor': config['heat_conductor']})
+        elif history_type == 'quantized':
+            history = QuantizedHistory(start_value=start_temp, end_value=end_temp, resolution=resolution)
+        elif history_type == 'ring':
+            history = RingHistory(shape=shape, window=window,
+                                  keyframe_interval=keyframe_interval, max_keyframes=max_keyframes)
+        else:
+            history = []
+        cube_data = p.propagate(history=history)
+
+        if history_type == 'memmap':
+            history.close()
+            a = Animator.from_file(history_filename, start_value=start_temp, end_value=end_temp, times=p.frame_times,
+                                   mask=mask, spacing=h.spacing)
+        elif history_type == 'archive':
+            history.close()
+            a = Animator(ChunkedArchive(archive_filename), start_value=start_temp, end_value=end_temp,
+                         times=p.frame_times, mask=mask, spacing=h.spacing)
+        elif history_type == 'ring':
+            # Play every state the ring holds one frame at a time, so the dense window of recent states is not
+            # squeezed into a few frames by the sparse keyframes that cover most of the simulated time
+            a = Animator(history, start_value=start_temp, end_value=end_temp, mask=mask, spacing=h.spacing)
+        else:
+            a = Animator(cube_data, start_value=start_temp, end_value=end_temp, times=p.frame_times, mask=mask,
+                         spacing=h.spacing)
+        a.plot()
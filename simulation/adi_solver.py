@@ -0,0 +1,112 @@
+import numpy as np
+from simulation.heat_conductor import HeatConductor
+
+
+class ADISolver:
+    """
+    The ADISolver class advances a cube over one conduction_time with an alternating-direction implicit scheme, which
+    is unconditionally stable for any conduction_time and costs O(N) per step.
+
+    The implicit conduction operator is split along x, y and z (a locally one-dimensional backward Euler scheme):
+    each step solves (I - A_x), (I - A_y) and (I - A_z) in turn. Along one axis every line of cells is an independent
+    tridiagonal system, and all lines are solved at once with a vectorized Thomas algorithm over the whole numpy array.
+    Unless the properties depend on temperature, the factorization of each axis is computed once and reused.
+
+    :param heat_conductor: An instance of the HeatConductor class providing the conduction coefficients.
+    """
+
+    def __init__(self, heat_conductor=HeatConductor):
+        self.heat_conductor = heat_conductor
+        self.factorizations = None
+        self.factorization_key = None
+        # The face coefficients the factorizations were built from. HeatConductor.update_coefficients() replaces them
+        # whenever the material or conduction_time changes, so holding on to them tells a stale factorization apart
+        self.factorized_face_numbers = None
+
+    def step(self, cube):
+        """
+        Advances the cube over one conduction_time.
+
+        :param cube: 3D numpy array of cell temperatures (K). It is updated in place.
+        :return: The updated cube.
+        """
+        for axis, (lower_coefficients, factors, inverse_pivots) in enumerate(self._get_factorizations(cube)):
+            lines = np.moveaxis(cube, axis, -1)
+            lines[...] = _solve_tridiagonal(lines, lower_coefficients, factors, inverse_pivots)
+        return cube
+
+    def _get_factorizations(self, cube):
+        """
+        Gets the Thomas factorization of (I - A) along each axis, reusing the previous one when the coefficients
+        cannot have changed.
+
+        :param cube: 3D numpy array of cell temperatures (K).
+        :return: A list with a (lower coefficients, factors, inverse pivots) tuple of arrays per axis, each with the
+                 axis moved last.
+        """
+        h = self.heat_conductor
+        key = (cube.shape, np.ndim(h.diffusion_number) == 0 and tuple(map(float, h.axis_diffusion_numbers)))
+        if (h.temperature_dependent or key != self.factorization_key
+                or h.face_numbers is not self.factorized_face_numbers):
+            face_numbers = h.get_face_numbers(cube)
+            self.factorizations = [self._factorize(cube.shape, axis, face_numbers) for axis in range(cube.ndim)]
+            self.factorization_key = key
+            self.factorized_face_numbers = h.face_numbers
+        return self.factorizations
+
+    def _factorize(self, shape, axis, face_numbers):
+        """
+        Builds the tridiagonal system (I - A_axis) for every line along an axis and runs the forward elimination of
+        the Thomas algorithm on its matrix.
+
+        :param shape: The shape of the cube.
+        :param axis: The axis the lines run along.
+        :param face_numbers: The face coefficients from HeatConductor.get_face_numbers().
+        :return: The (lower coefficients, factors, inverse pivots) of the factorization, with the axis moved last.
+        """
+        size = shape[axis]
+        line_shape = np.moveaxis(np.empty(shape), axis, -1).shape
+        # Temperature change of each cell per Kelvin of difference with its lower and upper neighbour
+        from_lower = np.zeros(line_shape)
+        from_upper = np.zeros(line_shape)
+        if face_numbers:
+            lower_numbers, upper_numbers, _ = face_numbers[axis]
+            from_upper[..., :-1] = np.moveaxis(lower_numbers, axis, -1)
+            from_lower[..., 1:] = np.moveaxis(upper_numbers, axis, -1)
+        else:
+            from_upper[..., :-1] = self.heat_conductor.axis_diffusion_numbers[axis]
+            from_lower[..., 1:] = self.heat_conductor.axis_diffusion_numbers[axis]
+
+        diagonal = 1 + from_lower + from_upper
+        lower_coefficients = -from_lower
+        upper_coefficients = -from_upper
+
+        factors = np.empty(line_shape)
+        inverse_pivots = np.empty(line_shape)
+        inverse_pivots[..., 0] = 1 / diagonal[..., 0]
+        factors[..., 0] = upper_coefficients[..., 0] * inverse_pivots[..., 0]
+        for i in range(1, size):
+            inverse_pivots[..., i] = 1 / (diagonal[..., i] - lower_coefficients[..., i] * factors[..., i - 1])
+            factors[..., i] = upper_coefficients[..., i] * inverse_pivots[..., i]
+        return lower_coefficients, factors, inverse_pivots
+
+
+def _solve_tridiagonal(right_hand_side, lower_coefficients, factors, inverse_pivots):
+    """
+    Solves many tridiagonal systems at once along the last axis with a factorized Thomas algorithm.
+
+    :param right_hand_side: Numpy array of right-hand sides, one system per line along the last axis.
+    :param lower_coefficients: The sub-diagonal of the systems.
+    :param factors: The upper coefficients divided by the pivots, from the forward elimination.
+    :param inverse_pivots: The inverses of the pivots, from the forward elimination.
+    :return: Numpy array of solutions with the shape of right_hand_side.
+    """
+    size = right_hand_side.shape[-1]
+    solution = np.empty_like(right_hand_side)
+    solution[..., 0] = right_hand_side[..., 0] * inverse_pivots[..., 0]
+    for i in range(1, size):
+        solution[..., i] = ((right_hand_side[..., i] - lower_coefficients[..., i] * solution[..., i - 1])
+                            * inverse_pivots[..., i])
+    for i in range(size - 2, -1, -1):
+        solution[..., i] -= factors[..., i] * solution[..., i + 1]
+    return solution
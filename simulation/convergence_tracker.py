@@ -0,0 +1,67 @@
+import numpy as np
+
+
+class ConvergenceTracker:
+    """
+    Keeps a running count of the cells of a cube that are outside the tolerance around a target temperature, so that
+    the Propagator can test for convergence in O(1) instead of scanning the whole cube every iteration.
+
+    Cells must be changed through set() or add() for the count to stay current. A full np.isclose pass is still made
+    every verify_interval checks, and before convergence is reported, as a safety net.
+
+    :param cube: The 3D numpy array of temperatures to track. It is updated in place.
+    :param target: The temperature every cell should converge to (K).
+    :param tolerance: The absolute tolerance used for the np.isclose check (K).
+    :param verify_interval: The number of convergence checks between full verification passes.
+    """
+
+    def __init__(self, cube, target, tolerance, verify_interval=1000):
+        self.cube = cube
+        self.target = target
+        self.tolerance = tolerance
+        self.verify_interval = verify_interval
+        self.checks = 0
+        self.unconverged_cells = self.count()
+
+    def count(self):
+        """
+        Counts the cells outside the tolerance with a full pass over the cube.
+
+        :return: The number of cells that are not close to the target.
+        """
+        return int(np.count_nonzero(~np.isclose(self.cube, self.target, rtol=0, atol=self.tolerance)))
+
+    def set(self, index, value):
+        """
+        Sets the temperature of one cell and updates the count.
+
+        :param index: The coordinates of the cell.
+        :param value: The new temperature of the cell (K).
+        """
+        old = float(self.cube[index])
+        value = float(value)
+        self.cube[index] = value
+        was_outside = abs(old - self.target) > self.tolerance
+        is_outside = abs(value - self.target) > self.tolerance
+        self.unconverged_cells += is_outside - was_outside
+
+    def add(self, index, delta):
+        """
+        Adds a temperature change to one cell and updates the count.
+
+        :param index: The coordinates of the cell.
+        :param delta: The temperature change (K).
+        """
+        self.set(index, self.cube[index] + delta)
+
+    def converged(self):
+        """
+        Tests whether every cell is within the tolerance of the target. The running count is replaced by a full count
+        every verify_interval checks and whenever it reaches zero.
+
+        :return: True if every cell is close to the target.
+        """
+        self.checks += 1
+        if self.unconverged_cells == 0 or self.checks % self.verify_interval == 0:
+            self.unconverged_cells = self.count()
+        return self.unconverged_cells == 0
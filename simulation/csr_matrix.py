@@ -0,0 +1,76 @@
+import numpy as np
+
+
+class CSRMatrix:
+    """
+    The CSRMatrix class holds a sparse square matrix in compressed sparse row format, with only numpy arrays: the
+    non-zero values of every row one after the other (data), their column (indices) and the position in data where
+    each row starts (indptr).
+
+    :param data: Numpy array of the non-zero values, row by row.
+    :param indices: Numpy array with the column of each value.
+    :param indptr: Numpy array with the start of every row in data, followed by the number of values.
+    """
+
+    def __init__(self, data, indices, indptr):
+        self.data = np.asarray(data, dtype=float)
+        self.indices = np.asarray(indices, dtype=np.int64)
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.size = len(self.indptr) - 1
+        # Row of every value, so that products are a single weighted bincount
+        self.rows = np.repeat(np.arange(self.size), np.diff(self.indptr))
+
+    @classmethod
+    def from_coordinates(cls, rows, columns, values, size):
+        """
+        Builds a matrix from (row, column, value) triplets. Values of repeated coordinates are summed.
+
+        :param rows: Numpy array with the row of each value.
+        :param columns: Numpy array with the column of each value.
+        :param values: Numpy array of the values.
+        :param size: The number of rows and columns.
+        :return: A CSRMatrix.
+        """
+        keys = np.asarray(rows, dtype=np.int64) * size + np.asarray(columns, dtype=np.int64)
+        unique_keys, positions = np.unique(keys, return_inverse=True)
+        data = np.bincount(positions, weights=values, minlength=len(unique_keys))
+        indptr = np.concatenate(([0], np.cumsum(np.bincount(unique_keys // size, minlength=size))))
+        return cls(data, unique_keys % size, indptr)
+
+    @classmethod
+    def load(cls, filename):
+        """
+        :param filename: A .npz file written by save().
+        :return: The CSRMatrix saved in the file.
+        """
+        with np.load(filename) as saved:
+            return cls(saved['data'], saved['indices'], saved['indptr'])
+
+    def save(self, filename):
+        """
+        :param filename: The .npz file to save the matrix to.
+        """
+        np.savez(filename, data=self.data, indices=self.indices, indptr=self.indptr)
+
+    def dot(self, vector):
+        """
+        :param vector: Numpy array with one value per column.
+        :return: Numpy array with the product of the matrix and the vector.
+        """
+        return np.bincount(self.rows, weights=self.data * vector[self.indices], minlength=self.size)
+
+    def diagonal(self):
+        """
+        :return: Numpy array with the diagonal of the matrix.
+        """
+        diagonal = np.zeros(self.size)
+        on_diagonal = self.indices == self.rows
+        diagonal[self.rows[on_diagonal]] = self.data[on_diagonal]
+        return diagonal
+
+    @property
+    def nbytes(self):
+        """
+        :return: The number of bytes of the data, indices and indptr arrays.
+        """
+        return self.data.nbytes + self.indices.nbytes + self.indptr.nbytes
@@ -0,0 +1,68 @@
+import numpy as np
+from simulation.heat_conductor import HeatConductor
+
+
+class GreenSolver:
+    """
+    The GreenSolver class evaluates the response of a cube of a uniform, constant material to temperature pulses at
+    one source cell, by superposing the discrete heat kernel (the Green's function of the grid) instead of stepping.
+
+    The conduction operator of HeatConductor.calculate_cube_changes() is separable along the axes, so the kernel of
+    a pulse is the product of one 1D kernel per axis. Each 1D kernel is computed with numpy's FFT on a periodic grid
+    of twice the length of the axis, which sums the kernel of the infinite grid over its periodic images, plus the
+    mirror image of the source, which together make the faces of the cube insulated. A batch of pulses at different
+    times is evaluated at once, and their responses are summed with a single einsum.
+
+    :param heat_conductor: An instance of the HeatConductor class with a uniform, constant material.
+    :param shape: The shape of the cube.
+    :param source: The index of the source cell.
+    """
+
+    def __init__(self, heat_conductor=HeatConductor, shape=(4, 4, 4), source=(0, 0, 0)):
+        if not heat_conductor.uniform or heat_conductor.temperature_dependent:
+            raise ValueError("The Green's function solver needs a uniform, constant material")
+        self.heat_conductor = heat_conductor
+        self.shape = tuple(shape)
+        self.source = tuple(source)
+        # Diffusion rate across one face along each axis (1/s)
+        self.rates = [number / heat_conductor.conduction_time for number in heat_conductor.axis_diffusion_numbers]
+
+    def axis_kernels(self, axis, lags):
+        """
+        Computes the 1D heat kernel along an axis for pulses of 1 K at the source.
+
+        :param axis: The axis.
+        :param lags: Numpy array of the times since each pulse (seconds).
+        :return: Numpy array with the temperature rise of every cell along the axis, one row per lag.
+        """
+        size = self.shape[axis]
+        source = self.source[axis]
+        wavenumbers = np.arange(size + 1)
+        symbols = np.exp(-self.rates[axis] * np.outer(lags, 2 - 2 * np.cos(np.pi * wavenumbers / size)))
+        # Kernel of the periodic grid of length 2·size, by distance from the pulse
+        periodic = np.fft.irfft(symbols, n=2 * size, axis=-1)
+        cells = np.arange(size)
+        # The source and its mirror image across the lower face, repeated every 2·size cells
+        return periodic[:, (cells - source) % (2 * size)] + periodic[:, (cells + source + 1) % (2 * size)]
+
+    def source_response(self, lags):
+        """
+        Computes the temperature rise of the source cell itself after pulses of 1 K.
+
+        :param lags: Numpy array of the times since each pulse (seconds).
+        :return: Numpy array with the temperature rise of the source for every lag.
+        """
+        response = np.ones(len(lags))
+        for axis in range(len(self.shape)):
+            response *= self.axis_kernels(axis, lags)[:, self.source[axis]]
+        return response
+
+    def superpose(self, lags):
+        """
+        Computes the temperature rise of every cell caused by pulses of 1 K at the source.
+
+        :param lags: Numpy array of the times since each pulse (seconds).
+        :return: Numpy array with the summed temperature rise of the cube (K).
+        """
+        x, y, z = (self.axis_kernels(axis, lags) for axis in range(3))
+        return np.einsum('pi,pj,pk->ijk', x, y, z)
@@ -1,3 +1,11 @@
+from functools import lru_cache
+import numpy as np
+from simulation.property_table import PropertyTable
+
+# Attributes the precomputed coefficients depend on
+COEFFICIENT_INPUTS = ('k', 'c_p', 'rho', 'conduction_time', 'delta_x', 'delta_y', 'delta_z', 'a')
+
+
 class HeatConductor:
     """
     This class models the heat conduction process through a material. It calculates the change in temperature that a
@@ -9,21 +17,144 @@ class HeatConductor:
     :param k: Thermal conductivity of the material (W/m·K). Higher values mean the material conducts heat faster.
     :param a: Cross-sectional area of the heat path through the cell (m²).
     :param delta_x: Spatial length of each cell (m). Smaller values make computations more precise.
+    :param delta_y: Optional length of each cell along the second axis (m). Defaults to delta_x.
+    :param delta_z: Optional length of each cell along the third axis (m). Defaults to delta_x.
     :param c_p: Specific heat capacity of the material (J/kg·K). It defines how much heat is needed to change
                 the temperature of 1 kg of the material by 1 K.
     :param rho: Density of the material (kg/m³). Together with `a` and `delta_x`, it helps compute the mass of a cell.
     :param conduction_time: The timestep over which the heat conduction process will be computed (seconds).
+    :param materials: Optional 3D numpy array of material ids, one per cell. When given, k, c_p and rho are looked up
+                      per cell in material_table instead.
+    :param material_table: A sequence of dictionaries with the k, c_p and rho of each material id.
+    :param k_curve: Optional sequence of (temperature, k) pairs for a temperature-dependent conductivity.
+    :param c_p_curve: Optional sequence of (temperature, c_p) pairs for a temperature-dependent specific heat.
+    :param table_range: The (low, high) temperatures the property curves are tabulated over, usually the start_temp
+                        and end_temp of the Propagator. Required with k_curve or c_p_curve.
+    :param table_size: The number of entries in the lookup table of each property curve.
+
+    k, c_p and rho may also be given directly as 3D numpy arrays, one value per cell, to model assemblies of mixed
+    materials. The conductance across the face between two cells is then the harmonic mean of their conductivities.
+
+    The diffusion number, the temperature change of a cell per Kelvin of difference with one neighbour over
+    conduction_time, is computed once and refreshed whenever one of the properties above changes. So are the face
+    coefficients of heterogeneous materials, so their per-step cost is the same as for a uniform material.
+
+    With delta_y or delta_z the cells are boxes rather than cubes, for instance to model thin plates with few cells
+    across their thickness. The volume of a cell stays a·delta_x, and the heat path along each axis has the length of
+    the cell along that axis and the cross-section of the volume over that length, so the diffusion number of each
+    axis is the Fourier number k·conduction_time / (rho·c_p·length²) of its spacing.
+
+    With k_curve or c_p_curve the property follows the temperature of each cell instead. The curves are resampled once
+    into dense lookup tables (see PropertyTable) and evaluated for the whole cube every step with a vectorized lerp.
     """
-    def __init__(self, k=237, c_p=900, rho=2700, min_delta=1E-5, conduction_time=1, delta_x=1, a=1):
+    def __init__(self, k=237, c_p=900, rho=2700, min_delta=1E-5, conduction_time=1, delta_x=1, a=1, materials=None,
+                 material_table=None, k_curve=None, c_p_curve=None, table_range=None, table_size=1024, delta_y=None,
+                 delta_z=None):
+        if materials is not None:
+            if material_table is None:
+                raise ValueError("material_table is required with materials")
+            materials = np.asarray(materials, dtype=int)
+            k, c_p, rho = (np.array([material[name] for material in material_table], dtype=float)[materials]
+                           for name in ('k', 'c_p', 'rho'))
+        self.materials = materials
+        if (k_curve is not None or c_p_curve is not None) and table_range is None:
+            raise ValueError("table_range is required with k_curve or c_p_curve")
+        self.k_table = PropertyTable(k_curve, *table_range, size=table_size) if k_curve is not None else None
+        self.c_p_table = PropertyTable(c_p_curve, *table_range, size=table_size) if c_p_curve is not None else None
         self.min_delta = min_delta
         self.k = k
         self.a = a
         self.conduction_time = conduction_time
         self.delta_x = delta_x
+        self.delta_y = delta_y
+        self.delta_z = delta_z
         self.c_p = c_p
         self.rho = rho
+        self.update_coefficients()
+
+    def __setattr__(self, name, value):
+        super().__setattr__(name, value)
+        # Keep the precomputed coefficients in step with the material properties
+        if name in COEFFICIENT_INPUTS and 'diffusion_number' in self.__dict__:
+            self.update_coefficients()
+
+    @property
+    def uniform(self):
+        """
+        :return: True if k, c_p and rho are single values for the whole cube.
+        """
+        return all(np.ndim(value) == 0 for value in (self.k, self.c_p, self.rho))
+
+    @property
+    def temperature_dependent(self):
+        """
+        :return: True if k or c_p follow the temperature of each cell.
+        """
+        return self.k_table is not None or self.c_p_table is not None
+
+    @property
+    def spacing(self):
+        """
+        :return: The length of a cell along each axis (m).
+        """
+        return tuple(self.delta_x if length is None else length
+                     for length in (self.delta_x, self.delta_y, self.delta_z))
+
+    @property
+    def shape(self):
+        """
+        :return: The shape of the per-cell material properties, or None for a uniform material.
+        """
+        if self.uniform:
+            return None
+        return np.broadcast_shapes(*(np.shape(value) for value in (self.k, self.c_p, self.rho)))
+
+    def update_coefficients(self):
+        """
+        Precomputes the diffusion number k·a·conduction_time / (delta_x · rho·a·delta_x · c_p) used by the array
+        methods, the same quantity calculate_temperature_change() works out step by step, and the diffusion number
+        of each axis from its spacing.
+
+        For heterogeneous materials it also precomputes, for every face along each axis, the temperature change of
+        the cells on either side per Kelvin of difference across the face, from the harmonic mean conductance.
+        """
+        mass = self.rho * self.a * self.delta_x
+        self.diffusion_number = self.k * self.a * self.conduction_time / (self.delta_x * mass * self.c_p)
+        self.axis_diffusion_numbers = tuple(self.diffusion_number * (self.delta_x / length) ** 2
+                                            for length in self.spacing)
+
+        self.face_numbers = []
+        if not self.uniform:
+            self.face_numbers = self.calculate_face_numbers(self.k, self.c_p, self.shape)
+
+    def calculate_face_numbers(self, k, c_p, shape):
+        """
+        Computes, for every face along each axis, the temperature change of the cells on either side per Kelvin of
+        difference across the face over conduction_time, using the harmonic mean of the conductivities of the two
+        cells.
 
-    def calculate_temperature_change(self, initial_temp, neighbour_temp):
+        :param k: Thermal conductivity, a single value or one per cell (W/m·K).
+        :param c_p: Specific heat capacity, a single value or one per cell (J/kg·K).
+        :param shape: The shape of the cube.
+        :return: A list with a (lower numbers, upper numbers, largest of the two) tuple of arrays per axis.
+        """
+        k = np.broadcast_to(k, shape).astype(float)
+        # Heat capacity of each cell (J/K)
+        capacity = np.broadcast_to(self.rho * self.a * self.delta_x * c_p, shape).astype(float)
+        face_numbers = []
+        for (lower, upper), length in zip(face_slices(len(shape)), self.spacing):
+            k_sum = k[lower] + k[upper]
+            harmonic_k = np.divide(2 * k[lower] * k[upper], k_sum, out=np.zeros_like(k_sum), where=k_sum > 0)
+            # Heat crossing the face per Kelvin of difference over conduction_time (J/K), through the cross-section
+            # a·delta_x / length of the cell over its length along the axis
+            area = self.a if length == self.delta_x else self.a * self.delta_x / length
+            conductance = harmonic_k * area * self.conduction_time / length
+            lower_numbers = conductance / capacity[lower]
+            upper_numbers = conductance / capacity[upper]
+            face_numbers.append((lower_numbers, upper_numbers, np.maximum(lower_numbers, upper_numbers)))
+        return face_numbers
+
+    def calculate_temperature_change(self, initial_temp, neighbour_temp, axis=0):
         """
         Predicts the change in the cell temperature caused by heat transfer to or from a neighboring cell.
 
@@ -36,10 +167,15 @@ class HeatConductor:
 
         :param initial_temp: Initial temperature of the cell (K).
         :param neighbour_temp: Temperature of the neighboring cell (K).
+        :param axis: The axis along which the neighbouring cell lies.
         :return: The change in the cell's temperature due to heat transferred to or from the neighbor cell (K).
         """
+        # Length of the heat path and cross-section of the cell along the axis (m, m²)
+        length = self.spacing[axis]
+        area = self.a if length == self.delta_x else self.a * self.delta_x / length
+
         # Calculate heat transferred rate (J/s)
-        q = -self.k * self.a * (initial_temp - neighbour_temp) / self.delta_x
+        q = -self.k * area * (initial_temp - neighbour_temp) / length
 
         # Calculate the total heat transferred over the time duration (J)
         delta_q = q * self.conduction_time
@@ -55,3 +191,145 @@ class HeatConductor:
             return 0
         else:
             return delta_temp
+
+    def calculate_temperature_changes(self, initial_temps, neighbour_temps, axis=0):
+        """
+        Array version of calculate_temperature_change(): predicts the change in temperature of many cells at once,
+        each caused by heat transfer to or from one neighbouring cell.
+
+        Changes smaller than min_delta are approximated to zero with a vectorized mask. The cells share one diffusion
+        number, so the material must be uniform; heterogeneous materials go through calculate_cube_changes().
+
+        :param initial_temps: Numpy array or single value of initial cell temperatures (K).
+        :param neighbour_temps: Numpy array of neighbouring cell temperatures (K), broadcastable with initial_temps.
+        :param axis: The axis along which the neighbouring cells lie.
+        :return: Numpy array of temperature changes of the cells (K).
+        """
+        if not self.uniform:
+            raise ValueError("calculate_temperature_changes() needs a uniform material, use calculate_cube_changes()")
+        delta_temps = self.axis_diffusion_numbers[axis] * (np.asarray(neighbour_temps) - np.asarray(initial_temps))
+        return np.where(np.abs(delta_temps) < self.min_delta, 0, delta_temps)
+
+    def calculate_cube_changes(self, cube, dead_band=True, face_numbers=None):
+        """
+        Predicts the change in temperature of every cell of a cube over one time step, caused by heat transfer with
+        its six neighbours (a 7-point Laplacian). Faces on the edge of the cube are insulated.
+
+        The transfer across every face between two adjacent cells is computed once by shifting the cube along each
+        axis, and applied with opposite signs to the two cells, so energy is conserved. For heterogeneous materials
+        the precomputed face coefficients are used, and a face is only approximated to zero when the change of both
+        cells is smaller than min_delta. For temperature-dependent properties the face coefficients are computed from
+        the lookup tables at the current temperatures of the cube.
+
+        :param cube: 3D numpy array of cell temperatures (K).
+        :param dead_band: Whether changes smaller than min_delta are approximated to zero. Without it the method is a
+                          linear operator on the cube, as needed by the implicit solvers.
+        :param face_numbers: Optional face coefficients from get_face_numbers(), to apply the operator of one set of
+                             temperatures to another array.
+        :return: 3D numpy array of temperature changes (K).
+        """
+        if face_numbers is None:
+            face_numbers = self.get_face_numbers(cube)
+
+        deltas = np.zeros_like(cube)
+        for axis, (lower, upper) in enumerate(face_slices(cube.ndim)):
+            difference = cube[upper] - cube[lower]
+            if not face_numbers:
+                # Temperature change of the lower cell caused by its neighbour across each face
+                face = self.axis_diffusion_numbers[axis] * difference
+                if dead_band:
+                    face[np.abs(face) < self.min_delta] = 0
+                deltas[lower] += face
+                deltas[upper] -= face
+            else:
+                lower_numbers, upper_numbers, max_numbers = face_numbers[axis]
+                lower_change = lower_numbers * difference
+                upper_change = upper_numbers * difference
+                if dead_band:
+                    below = np.abs(difference) * max_numbers < self.min_delta
+                    lower_change[below] = 0
+                    upper_change[below] = 0
+                deltas[lower] += lower_change
+                deltas[upper] -= upper_change
+        return deltas
+
+    def get_face_numbers(self, cube):
+        """
+        Gets the face coefficients that apply to a cube: the precomputed ones for heterogeneous materials, ones
+        computed from the lookup tables at the temperatures of the cube for temperature-dependent properties, and an
+        empty list for a uniform material, which only needs the diffusion number.
+
+        :param cube: 3D numpy array of cell temperatures (K).
+        :return: A list of face coefficients per axis, see calculate_face_numbers().
+        """
+        if not self.temperature_dependent:
+            return self.face_numbers
+        k = self.k_table(cube) if self.k_table is not None else self.k
+        c_p = self.c_p_table(cube) if self.c_p_table is not None else self.c_p
+        return self.calculate_face_numbers(k, c_p, cube.shape)
+
+    def calculate_operator_diagonal(self, shape, face_numbers):
+        """
+        Computes the diagonal of the conduction operator applied by calculate_cube_changes(): minus the sum of the
+        face coefficients of each cell.
+
+        :param shape: The shape of the cube.
+        :param face_numbers: The face coefficients from get_face_numbers().
+        :return: Numpy array with the diagonal of the operator.
+        """
+        diagonal = np.zeros(shape)
+        for axis, (lower, upper) in enumerate(face_slices(len(shape))):
+            if face_numbers:
+                lower_numbers, upper_numbers, _ = face_numbers[axis]
+            else:
+                lower_numbers = upper_numbers = self.axis_diffusion_numbers[axis]
+            diagonal[lower] -= lower_numbers
+            diagonal[upper] -= upper_numbers
+        return diagonal
+
+    def calculate_stable_substeps(self, shape):
+        """
+        Computes the fewest sub-steps conduction_time must be split into for the explicit update of
+        calculate_cube_changes() to be stable without overshoot: the sum of the face coefficients of every cell
+        (6 times the Fourier number k·dt/(rho·c_p·dx²) for a uniform material of cubic cells) must not exceed 1.
+
+        Temperature-dependent properties are bounded by the largest k and smallest c_p of their lookup tables.
+
+        :param shape: The shape of the cube.
+        :return: The number of sub-steps, at least 1.
+        """
+        face_numbers = self.face_numbers
+        if self.temperature_dependent:
+            k = self.k_table.values.max() if self.k_table is not None else self.k
+            c_p = self.c_p_table.values.min() if self.c_p_table is not None else self.c_p
+            face_numbers = self.calculate_face_numbers(k, c_p, shape)
+        largest_sum = -self.calculate_operator_diagonal(shape, face_numbers).min()
+        return max(1, int(np.ceil(largest_sum)))
+
+    def get_capacity(self, cube):
+        """
+        Gets the heat capacity of the cells of a cube, rho·a·delta_x·c_p, at the temperatures of the cube.
+
+        :param cube: 3D numpy array of cell temperatures (K).
+        :return: The heat capacity of each cell (J/K), a single value for a uniform, constant material.
+        """
+        c_p = self.c_p_table(cube) if self.c_p_table is not None else self.c_p
+        return self.rho * self.a * self.delta_x * c_p
+
+
+@lru_cache(maxsize=None)
+def face_slices(ndim):
+    """
+    Builds the slices selecting the cells on the lower and upper side of every face along each axis.
+
+    :param ndim: The number of dimensions of the cube.
+    :return: A tuple with a (lower, upper) pair of slice tuples per axis.
+    """
+    faces = []
+    for axis in range(ndim):
+        lower = [slice(None)] * ndim
+        upper = [slice(None)] * ndim
+        lower[axis] = slice(None, -1)
+        upper[axis] = slice(1, None)
+        faces.append((tuple(lower), tuple(upper)))
+    return tuple(faces)
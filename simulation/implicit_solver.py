@@ -0,0 +1,85 @@
+import numpy as np
+from simulation.heat_conductor import HeatConductor
+
+# Weight of the new temperatures in the operator of each scheme
+SCHEMES = {'backward_euler': 1.0, 'crank_nicolson': 0.5}
+
+
+class ImplicitSolver:
+    """
+    The ImplicitSolver class advances a cube over one conduction_time with an implicit time integration scheme, which
+    stays stable for any conduction_time, unlike the explicit stencil.
+
+    The conduction operator A is applied matrix-free with HeatConductor.calculate_cube_changes() (without the
+    min_delta dead-band, so it is linear). Each step solves (I - θ·A)·T_new = (I + (1 - θ)·A)·T_old with a Jacobi
+    preconditioned conjugate-gradient method, where θ is 1 for backward Euler and 0.5 for Crank–Nicolson. Inner
+    products are weighted by the heat capacity of the cells, which makes the operator symmetric for mixed materials.
+
+    :param heat_conductor: An instance of the HeatConductor class providing the conduction coefficients.
+    :param scheme: The time integration scheme, 'backward_euler' or 'crank_nicolson'.
+    :param tolerance: The conjugate-gradient solve stops once the residual norm falls below tolerance times the norm
+                      of the right-hand side.
+    :param max_iterations: The maximum number of conjugate-gradient iterations per step.
+    """
+
+    def __init__(self, heat_conductor=HeatConductor, scheme='backward_euler', tolerance=1E-8, max_iterations=500):
+        if scheme not in SCHEMES:
+            raise ValueError(f"Unknown scheme '{scheme}', expected one of {tuple(SCHEMES)}")
+        self.heat_conductor = heat_conductor
+        self.scheme = scheme
+        self.theta = SCHEMES[scheme]
+        self.tolerance = tolerance
+        self.max_iterations = max_iterations
+        # Number of conjugate-gradient iterations and final relative residual of each step
+        self.iterations = []
+        self.residuals = []
+
+    def step(self, cube):
+        """
+        Advances the cube over one conduction_time.
+
+        :param cube: 3D numpy array of cell temperatures (K). It is updated in place.
+        :return: The updated cube.
+        """
+        h = self.heat_conductor
+        # Temperature-dependent properties are linearised at the temperatures at the start of the step
+        face_numbers = h.get_face_numbers(cube)
+        weights = h.get_capacity(cube)
+
+        def operator(values):
+            return h.calculate_cube_changes(values, dead_band=False, face_numbers=face_numbers)
+
+        def system(values):
+            return values - self.theta * operator(values)
+
+        def dot(a, b):
+            return np.sum(weights * a * b)
+
+        right_hand_side = cube + (1 - self.theta) * operator(cube) if self.theta < 1 else cube.copy()
+        preconditioner = 1 / (1 - self.theta * h.calculate_operator_diagonal(cube.shape, face_numbers))
+
+        solution = cube.copy()
+        residual = right_hand_side - system(solution)
+        z = residual * preconditioner
+        direction = z.copy()
+        rz = dot(residual, z)
+        norm = np.sqrt(dot(right_hand_side, right_hand_side))
+
+        iterations = 0
+        relative_residual = np.sqrt(dot(residual, residual)) / norm
+        while relative_residual > self.tolerance and iterations < self.max_iterations:
+            iterations += 1
+            system_direction = system(direction)
+            alpha = rz / dot(direction, system_direction)
+            solution += alpha * direction
+            residual -= alpha * system_direction
+            z = residual * preconditioner
+            rz_next = dot(residual, z)
+            direction = z + (rz_next / rz) * direction
+            rz = rz_next
+            relative_residual = np.sqrt(dot(residual, residual)) / norm
+
+        self.iterations.append(iterations)
+        self.residuals.append(float(relative_residual))
+        cube[...] = solution
+        return cube
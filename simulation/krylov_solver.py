@@ -0,0 +1,259 @@
+import numpy as np
+from simulation.heat_conductor import HeatConductor
+
+
+class KrylovSolver:
+    """
+    The KrylovSolver class advances a cube over any length of time t with the matrix exponential of the conduction
+    operator, exp(t·A)·u, approximated in a Krylov subspace. There is no stability limit on the time step.
+
+    The operator A of HeatConductor.calculate_cube_changes() (without the min_delta dead-band) is applied matrix-free.
+    Heat conduction is stiff, so the subspace is built with the shift-and-invert Lanczos method: its basis V comes
+    from repeated solves of (I - γ·A)·x = v, with γ = t/10, which find the slow modes that dominate long time jumps
+    in a few iterations whatever the time step. Inner products are weighted by the heat capacity of the cells so that
+    mixed materials stay symmetric, and the solves use a Jacobi preconditioned conjugate-gradient method. With T the
+    small tridiagonal Lanczos matrix, exp(t·A)·u ≈ |u|·V·exp(t·(I - T⁻¹)/γ)·e1. The basis grows until the
+    approximation changes by less than tolerance; if it has not converged at max_dimension, the time is split into
+    shorter sub-steps.
+
+    Temperature-dependent properties are linearised at the temperatures at the start of each sub-step.
+
+    :param heat_conductor: An instance of the HeatConductor class providing the conduction coefficients.
+    :param shape: The shape of the cube.
+    :param tolerance: The largest estimated error of a sub-step, relative to the norm of the cube, weighted by heat
+                      capacity.
+    :param max_dimension: The largest dimension of the Krylov subspace.
+    :param max_iterations: The maximum number of conjugate-gradient iterations per solve.
+    """
+
+    def __init__(self, heat_conductor=HeatConductor, shape=(4, 4, 4), tolerance=1E-8, max_dimension=30,
+                 max_iterations=500):
+        if max_dimension < 2:
+            raise ValueError("max_dimension must be at least 2")
+        self.heat_conductor = heat_conductor
+        self.shape = tuple(shape)
+        self.tolerance = tolerance
+        self.max_dimension = max_dimension
+        self.max_iterations = max_iterations
+        # Krylov dimension and estimated relative error of each sub-step
+        self.iterations = []
+        self.residuals = []
+
+    def step(self, cube):
+        """
+        Advances the cube over one conduction_time.
+
+        :param cube: 3D numpy array of cell temperatures (K). It is updated in place.
+        :return: The updated cube.
+        """
+        cube[...] = self.advance(cube, self.heat_conductor.conduction_time)
+        return cube
+
+    def transform(self, cube):
+        """
+        The Krylov solver works on the temperatures themselves, so they are its state, see Propagator.states_at().
+
+        :param cube: Numpy array of cell temperatures (K).
+        :return: A copy of the cube.
+        """
+        return np.array(cube, dtype=float)
+
+    def inverse(self, state):
+        """
+        :param state: A state from transform().
+        :return: A copy of the cube of the state.
+        """
+        return state.copy()
+
+    def basis_at(self, index):
+        """
+        :param index: The index of a cell.
+        :return: Numpy array selecting the temperature of the cell from a state.
+        """
+        impulse = np.zeros(self.shape)
+        impulse[index] = 1
+        return impulse
+
+    def advance(self, cube, duration):
+        """
+        Computes exp(duration·A)·cube, in as few sub-steps as the tolerance allows.
+
+        With insulated faces the mean temperature, weighted by heat capacity, is conserved, so it is set aside and
+        only the deviation from it is advanced in the Krylov subspace.
+
+        :param cube: Numpy array of cell temperatures (K).
+        :param duration: The length of simulated time to advance by (seconds).
+        :return: A new numpy array with the advanced cube.
+        """
+        h = self.heat_conductor
+        cube = np.array(cube, dtype=float)
+        remaining = duration
+        time_step = duration
+        while remaining > 0:
+            time_step = min(time_step, remaining)
+            face_numbers = h.get_face_numbers(cube)
+            weights = np.broadcast_to(h.get_capacity(cube), cube.shape)
+
+            mean = np.sum(weights * cube) / np.sum(weights)
+            deviation = cube - mean
+            norm = np.sqrt(np.sum(weights * deviation * deviation))
+            cube_norm = np.sqrt(np.sum(weights * cube * cube))
+            if norm <= self.tolerance * cube_norm:
+                return cube
+
+            result = self._advance_deviation(deviation / norm, time_step, face_numbers, weights,
+                                             self.tolerance * cube_norm / norm)
+            if result is None:
+                # Not converged at max_dimension, so try a shorter sub-step
+                time_step /= 2
+                continue
+            cube = mean + norm * result
+            remaining -= time_step
+        return cube
+
+    def expand(self, cube, durations):
+        """
+        Approximates exp(t·A)·cube for many durations t at once from a single shift-and-invert Lanczos subspace, as
+        the conserved mean plus Ritz modes that each decay on their own: exp(t·A)·cube ≈ mean + Σ modes·exp(-rates·t).
+        The shift is the shortest positive duration, and the basis grows until the approximation changes by less than
+        tolerance at every duration, up to max_dimension. The properties must not depend on temperature, as the modes
+        are built from the operator of a single set of coefficients.
+
+        :param cube: Numpy array of cell temperatures (K).
+        :param durations: A sequence of lengths of simulated time (seconds) the expansion must be accurate for.
+        :return: The mean temperature (K), the decay rate of every mode (1/s) and a numpy array with the temperatures
+                 of each mode (K), one mode per row, or None if it did not converge within max_dimension.
+        """
+        h = self.heat_conductor
+        if h.temperature_dependent:
+            raise ValueError("The Krylov expansion needs properties that do not depend on temperature")
+        cube = np.array(cube, dtype=float)
+        durations = np.unique(np.asarray(durations, dtype=float))
+        face_numbers = h.get_face_numbers(cube)
+        weights = np.broadcast_to(h.get_capacity(cube), cube.shape)
+
+        mean = np.sum(weights * cube) / np.sum(weights)
+        deviation = cube - mean
+        norm = np.sqrt(np.sum(weights * deviation * deviation))
+        if norm == 0:
+            return mean, np.zeros(0), np.zeros((0,) + cube.shape)
+        positive = durations[durations > 0]
+        shift = positive.min() if len(positive) else h.conduction_time
+
+        vectors = [deviation / norm]
+        alphas = []
+        betas = []
+        previous = None
+        while True:
+            product = self._solve_shifted(vectors[-1], shift, face_numbers, weights)
+            alphas.append(np.sum(weights * vectors[-1] * product))
+            for _ in range(2):
+                for basis_vector in vectors:
+                    product -= np.sum(weights * basis_vector * product) * basis_vector
+            beta = np.sqrt(np.sum(weights * product * product))
+
+            eigenvalues, eigenvectors = np.linalg.eigh(np.diag(alphas) + np.diag(betas, 1) + np.diag(betas, -1))
+            rates = (1 / np.maximum(eigenvalues, 1E-300) - 1) / shift
+            # Coefficients of the basis vectors at every duration, one row per duration
+            coefficients = (np.exp(-np.outer(durations, rates)) * eigenvectors[0]) @ eigenvectors.T
+
+            breakdown = beta <= 1E-12 * abs(eigenvalues).max()
+            if previous is not None or breakdown:
+                change = 0 if previous is None else np.max(np.sqrt(
+                    np.sum((coefficients[:, :-1] - previous) ** 2, axis=1) + coefficients[:, -1] ** 2))
+                if change <= self.tolerance or breakdown or len(vectors) == cube.size:
+                    self.iterations.append(len(vectors))
+                    self.residuals.append(float(change))
+                    # Each Ritz mode is its eigenvector of the Lanczos matrix, weighted by its share of the cube
+                    modes = np.tensordot(eigenvectors.T * (norm * eigenvectors[0])[:, None], np.array(vectors), axes=1)
+                    return mean, rates, modes
+            if len(vectors) == self.max_dimension:
+                return None
+            previous = coefficients
+            betas.append(beta)
+            vectors.append(product / beta)
+
+    def _advance_deviation(self, vector, duration, face_numbers, weights, tolerance):
+        """
+        Computes exp(duration·A)·vector with the shift-and-invert Lanczos method.
+
+        :param vector: Numpy array with a norm of 1, weighted by heat capacity.
+        :param duration: The length of simulated time to advance by (seconds).
+        :param face_numbers: The face coefficients from HeatConductor.get_face_numbers().
+        :param weights: The heat capacity of every cell.
+        :param tolerance: The largest change of the approximation, relative to the norm of vector, at which the
+                          basis stops growing.
+        :return: A numpy array with the advanced vector, or None if it did not converge within max_dimension.
+        """
+        shift = duration / 10
+        vectors = [vector]
+        alphas = []
+        betas = []
+        previous = None
+        while True:
+            product = self._solve_shifted(vectors[-1], shift, face_numbers, weights)
+            alphas.append(np.sum(weights * vectors[-1] * product))
+            # Orthogonalize against the whole basis twice to keep it orthonormal in floating point
+            for _ in range(2):
+                for basis_vector in vectors:
+                    product -= np.sum(weights * basis_vector * product) * basis_vector
+            beta = np.sqrt(np.sum(weights * product * product))
+
+            # The eigenvalues μ of T give the Ritz values (1 - 1/μ)/γ of A
+            eigenvalues, eigenvectors = np.linalg.eigh(np.diag(alphas) + np.diag(betas, 1) + np.diag(betas, -1))
+            rates = (1 - 1 / np.maximum(eigenvalues, 1E-300)) / shift
+            coefficients = eigenvectors @ (np.exp(duration * rates) * eigenvectors[0])
+
+            # The approximation has converged once the last basis vector barely changes it
+            change = np.inf if previous is None else np.sqrt(np.sum((coefficients[:-1] - previous) ** 2) +
+                                                             coefficients[-1] ** 2)
+            if change <= tolerance or beta <= 1E-12 * abs(eigenvalues).max():
+                self.iterations.append(len(vectors))
+                self.residuals.append(float(0 if previous is None else change))
+                return np.tensordot(coefficients, np.array(vectors), axes=1)
+            if len(vectors) == self.max_dimension:
+                return None
+            previous = coefficients
+            betas.append(beta)
+            vectors.append(product / beta)
+
+    def _solve_shifted(self, right_hand_side, shift, face_numbers, weights):
+        """
+        Solves (I - shift·A)·x = right_hand_side with a Jacobi preconditioned conjugate-gradient method, with inner
+        products weighted by the heat capacity.
+
+        :param right_hand_side: Numpy array of the right-hand side.
+        :param shift: The shift γ (seconds).
+        :param face_numbers: The face coefficients from HeatConductor.get_face_numbers().
+        :param weights: The heat capacity of every cell.
+        :return: Numpy array with the solution.
+        """
+        h = self.heat_conductor
+        # The conduction operator over conduction_time, scaled to the shift
+        scale = shift / h.conduction_time
+
+        def system(values):
+            return values - scale * h.calculate_cube_changes(values, dead_band=False, face_numbers=face_numbers)
+
+        def dot(a, b):
+            return np.sum(weights * a * b)
+
+        preconditioner = 1 / (1 - scale * h.calculate_operator_diagonal(right_hand_side.shape, face_numbers))
+        solution = right_hand_side * preconditioner
+        residual = right_hand_side - system(solution)
+        z = residual * preconditioner
+        direction = z.copy()
+        rz = dot(residual, z)
+        norm = np.sqrt(dot(right_hand_side, right_hand_side))
+        iterations = 0
+        while np.sqrt(dot(residual, residual)) > 0.1 * self.tolerance * norm and iterations < self.max_iterations:
+            iterations += 1
+            system_direction = system(direction)
+            alpha = rz / dot(direction, system_direction)
+            solution += alpha * direction
+            residual -= alpha * system_direction
+            z = residual * preconditioner
+            rz_next = dot(residual, z)
+            direction = z + (rz_next / rz) * direction
+            rz = rz_next
+        return solution
@@ -0,0 +1,166 @@
+import hashlib
+import os
+import numpy as np
+from simulation.heat_conductor import HeatConductor
+
+# Number of vectors the Krylov basis grows by at a time, the largest repeated eigenvalue the modes resolve in one go
+BLOCK_SIZE = 16
+
+
+class ModalSolver:
+    """
+    The ModalSolver class advances a cube of any constant material over any length of time from the lowest eigenmodes
+    of its conduction operator, computed once per geometry and material set.
+
+    Each eigenmode φ of the operator of HeatConductor.calculate_cube_changes() decays on its own as exp(-λ·t). The
+    lowest modes are found with the block Lanczos method, applying the operator matrix-free, with inner products
+    weighted by the heat capacity of the cells so that mixed materials stay symmetric. Projecting a cube onto the modes
+    costs O(N·M) and so does reconstructing it at any time, without time-stepping. The slowest modes dominate
+    everything but the first moments after a change, and with as many modes as cells the solution is exact.
+
+    The eigenpairs only depend on the shape of the cube and the material, not on conduction_time or the heating
+    schedule, so they are saved to cache_dir and loaded from there by every later solver of the same part.
+
+    :param heat_conductor: An instance of the HeatConductor class with properties that do not depend on temperature.
+    :param shape: The shape of the cube.
+    :param modes: The number of eigenmodes to compute, at most the number of cells.
+    :param cache_dir: Optional directory the eigenpairs are saved to and loaded from.
+    :param tolerance: The block Lanczos iterations stop once the residual of every mode is below tolerance times the
+                      largest eigenvalue found.
+    """
+
+    def __init__(self, heat_conductor=HeatConductor, shape=(4, 4, 4), modes=64, cache_dir=None, tolerance=1E-8):
+        if heat_conductor.temperature_dependent:
+            raise ValueError("The modal solver needs properties that do not depend on temperature")
+        self.heat_conductor = heat_conductor
+        self.shape = tuple(shape)
+        self.modes = min(modes, int(np.prod(self.shape)))
+        self.tolerance = tolerance
+        self.capacity = np.broadcast_to(heat_conductor.get_capacity(None), self.shape).astype(float)
+
+        filename = os.path.join(cache_dir, f'modes_{self.cache_key()}.npz') if cache_dir is not None else None
+        if filename is not None and os.path.exists(filename):
+            with np.load(filename) as cached:
+                self.eigenvalues, self.eigenvectors = cached['eigenvalues'], cached['eigenvectors']
+        else:
+            self.eigenvalues, self.eigenvectors = self._compute_modes()
+            if filename is not None:
+                os.makedirs(cache_dir, exist_ok=True)
+                np.savez(filename, eigenvalues=self.eigenvalues, eigenvectors=self.eigenvectors)
+        self.step_decay = self.decay(heat_conductor.conduction_time)
+
+    def cache_key(self):
+        """
+        :return: A digest of everything the eigenpairs depend on: the shape, the material properties, the cell size
+                 and the number of modes.
+        """
+        h = self.heat_conductor
+        digest = hashlib.sha1(repr((self.shape, self.modes, h.a, h.spacing)).encode())
+        for value in (h.k, h.c_p, h.rho):
+            digest.update(np.ascontiguousarray(value, dtype=float).tobytes())
+            digest.update(repr(np.shape(value)).encode())
+        return digest.hexdigest()
+
+    def decay(self, duration):
+        """
+        :param duration: A length of simulated time (seconds).
+        :return: Numpy array with the factor every mode decays by over the duration.
+        """
+        return np.exp(-self.eigenvalues * duration)
+
+    def advance(self, modes, duration):
+        """
+        :param modes: Numpy array of mode amplitudes.
+        :param duration: A length of simulated time (seconds).
+        :return: Numpy array with the mode amplitudes after the duration.
+        """
+        return modes * self.decay(duration)
+
+    def step(self, cube):
+        """
+        Advances the cube over one conduction_time.
+
+        :param cube: 3D numpy array of cell temperatures (K). It is updated in place.
+        :return: The updated cube.
+        """
+        cube[...] = self.inverse(self.transform(cube) * self.step_decay)
+        return cube
+
+    def basis_at(self, index):
+        """
+        :param index: The index of a cell.
+        :return: Numpy array with the value of every mode at the cell, so that the temperature of the cell is the sum
+                 of the mode amplitudes times these values.
+        """
+        return self.eigenvectors[:, np.ravel_multi_index(index, self.shape)]
+
+    def transform(self, cube):
+        """
+        Projects a cube onto the modes.
+
+        :param cube: Numpy array of cell temperatures (K).
+        :return: Numpy array with the amplitude of every mode.
+        """
+        return self.eigenvectors @ (self.capacity * cube).ravel()
+
+    def inverse(self, modes):
+        """
+        Reconstructs the cube of given mode amplitudes.
+
+        :param modes: Numpy array with the amplitude of every mode.
+        :return: Numpy array of cell temperatures (K).
+        """
+        return (modes @ self.eigenvectors).reshape(self.shape)
+
+    def _compute_modes(self):
+        """
+        Finds the lowest eigenpairs of the conduction operator with the block Lanczos method: a Krylov basis grown a
+        block of vectors at a time with full reorthogonalization, and the Rayleigh–Ritz modes of the basis checked
+        after every block. Blocks of several vectors find the repeated eigenvalues of symmetric parts, which a single
+        Lanczos vector misses.
+
+        :return: The eigenvalues (1/s), lowest first, and an array with one eigenvector per row, orthonormal with
+                 inner products weighted by the heat capacity.
+        """
+        h = self.heat_conductor
+        size = int(np.prod(self.shape))
+        face_numbers = h.get_face_numbers(None)
+        weights = self.capacity.ravel()
+
+        def operator(vector):
+            # Decay rate of the temperatures (1/s)
+            changes = h.calculate_cube_changes(vector.reshape(self.shape), dead_band=False, face_numbers=face_numbers)
+            return -changes.ravel() / h.conduction_time
+
+        basis = np.empty((0, size))
+        products = np.empty((0, size))
+        projection = np.empty((0, 0))
+        block = np.random.default_rng(0).standard_normal((min(BLOCK_SIZE, size), size))
+        blocks = 0
+        while True:
+            # Orthogonalize twice against the basis to keep it orthonormal in floating point, then within the block
+            for _ in range(2):
+                block -= (block @ (weights * basis).T) @ basis
+            gram = (block * weights) @ block.T
+            values, vectors = np.linalg.eigh(gram)
+            independent = values > 1E-10 * values.max()
+            block = (vectors[:, independent] / np.sqrt(values[independent])).T @ block
+            block_products = np.array([operator(vector) for vector in block])
+
+            # Extend the projection of the operator onto the basis with the rows and columns of the new block
+            columns = (np.concatenate((basis, block)) * weights) @ block_products.T
+            previous = columns[:len(basis)]
+            projection = np.block([[projection, previous], [previous.T, columns[len(basis):]]])
+            basis = np.concatenate((basis, block))
+            products = np.concatenate((products, block_products))
+            blocks += 1
+
+            if len(basis) >= self.modes and (blocks % 4 == 0 or len(basis) == size):
+                eigenvalues, ritz_vectors = np.linalg.eigh((projection + projection.T) / 2)
+                lowest = ritz_vectors[:, :self.modes].T
+                eigenvectors = lowest @ basis
+                residuals = lowest @ products - eigenvalues[:self.modes, None] * eigenvectors
+                norms = np.sqrt(np.sum(weights * residuals * residuals, axis=1))
+                if len(basis) == size or np.all(norms <= self.tolerance * abs(eigenvalues[-1])):
+                    return np.maximum(eigenvalues[:self.modes], 0), eigenvectors
+            block = block_products
@@ -0,0 +1,223 @@
+import numpy as np
+from simulation.heat_conductor import HeatConductor, face_slices
+
+
+class MultigridSolver:
+    """
+    The MultigridSolver class solves for the steady state of a cube directly, the temperatures at which no heat flows
+    any more, instead of stepping through the transient. Cells in a fixed mask are held at their temperature, like a
+    source kept at end_temp, and faces on the edge of the cube are insulated.
+
+    The steady state balances the heat flowing across the faces of every free cell, a Laplace problem with the harmonic
+    mean conductances of HeatConductor. It is solved with conjugate-gradient iterations preconditioned by a geometric
+    multigrid V-cycle: red-black Gauss-Seidel smoothing on every level, and coarse levels built by merging 2x2x2 blocks
+    of cells, whose faces conduct half the heat of the fine faces they cover. Every cycle costs O(N), and the number of
+    cycles barely grows with the size of the cube, however slow the transient would be.
+
+    With temperature-dependent properties the conductances are recomputed from the temperatures of the last solve,
+    and the solve repeated until the residual at the new conductances is below tolerance as well.
+
+    :param heat_conductor: An instance of the HeatConductor class providing the conduction coefficients.
+    :param tolerance: The solve stops once the residual norm falls below tolerance times its initial norm.
+    :param max_cycles: The maximum number of V-cycles, one per conjugate-gradient iteration.
+    :param smoothing_steps: The number of Gauss-Seidel sweeps before and after each coarse-level correction.
+    """
+
+    def __init__(self, heat_conductor=HeatConductor, tolerance=1E-8, max_cycles=100, smoothing_steps=2):
+        self.heat_conductor = heat_conductor
+        self.tolerance = tolerance
+        self.max_cycles = max_cycles
+        self.smoothing_steps = smoothing_steps
+        # Number of V-cycles, relative residual after each of them and number of levels of the last solve
+        self.cycles = 0
+        self.residuals = []
+        self.levels = 0
+
+    def solve(self, cube, fixed):
+        """
+        Solves for the steady state of the cube.
+
+        :param cube: 3D numpy array of cell temperatures (K), used as the initial guess. It is updated in place.
+        :param fixed: 3D boolean numpy array marking the cells held at their temperature in the cube.
+        :return: The steady state cube.
+        """
+        fixed = np.asarray(fixed, dtype=bool)
+        self.cycles = 0
+        self.residuals = []
+        initial_norm = None
+        while True:
+            levels = self._build_levels(cube, fixed)
+            self.levels = len(levels)
+            conductances = levels[0][0]
+
+            # Net heat flowing into every free cell; zero everywhere at the steady state
+            residual = _apply_operator(cube, conductances)
+            residual[fixed] = 0
+            norm = np.sqrt(np.sum(residual * residual))
+            if initial_norm is None:
+                initial_norm = norm
+            if norm <= self.tolerance * initial_norm or self.cycles >= self.max_cycles:
+                return cube
+
+            # Conjugate-gradient iterations preconditioned by one V-cycle each
+            correction = np.zeros_like(cube)
+            z = self._cycle(levels, 0, residual)
+            direction = z.copy()
+            rz = np.sum(residual * z)
+            while self.cycles < self.max_cycles:
+                self.cycles += 1
+                system_direction = -_apply_operator(direction, conductances)
+                system_direction[fixed] = 0
+                alpha = rz / np.sum(direction * system_direction)
+                correction += alpha * direction
+                residual -= alpha * system_direction
+                norm = np.sqrt(np.sum(residual * residual))
+                self.residuals.append(float(norm / initial_norm))
+                if norm <= self.tolerance * initial_norm:
+                    break
+                z = self._cycle(levels, 0, residual)
+                rz_next = np.sum(residual * z)
+                direction = z + (rz_next / rz) * direction
+                rz = rz_next
+            cube += correction
+
+            # The conductances only change with the temperatures for temperature-dependent properties
+            if not self.heat_conductor.temperature_dependent:
+                return cube
+
+    def _build_levels(self, cube, fixed):
+        """
+        Builds the hierarchy of levels, from the cube down to at most 2 cells along each axis.
+
+        :param cube: 3D numpy array of cell temperatures (K), to evaluate temperature-dependent properties at.
+        :param fixed: 3D boolean numpy array marking the fixed cells.
+        :return: A list with the (conductances per axis, diagonal, fixed mask) of every level, finest first.
+        """
+        h = self.heat_conductor
+        face_numbers = h.get_face_numbers(cube)
+        capacity = np.broadcast_to(h.get_capacity(cube), cube.shape)
+        conductances = []
+        for axis, (lower, upper) in enumerate(face_slices(cube.ndim)):
+            # Heat crossing each face per Kelvin of difference over conduction_time (J/K)
+            numbers = face_numbers[axis][0] if face_numbers else h.axis_diffusion_numbers[axis]
+            conductances.append(np.broadcast_to(numbers * capacity[lower], capacity[lower].shape).astype(float))
+
+        levels = [(conductances, _calculate_diagonal(cube.shape, conductances), fixed)]
+        while max(fixed.shape) > 2:
+            coarse_conductances = []
+            for axis, faces in enumerate(conductances):
+                # Only every other face separates two blocks; they conduct like one face of twice the size
+                crossing = np.take(faces, np.arange(1, faces.shape[axis], 2), axis=axis)
+                coarse_conductances.append(0.5 * _sum_blocks(crossing, skip_axis=axis))
+            conductances = coarse_conductances
+            fixed = _sum_blocks(fixed.astype(float)) > 0
+            levels.append((conductances, _calculate_diagonal(fixed.shape, conductances), fixed))
+        return levels
+
+    def _cycle(self, levels, level, right_hand_side):
+        """
+        Runs one V-cycle for the correction of a level: the temperatures that balance right_hand_side, the net heat
+        still flowing into every cell.
+
+        :param levels: The hierarchy of levels from _build_levels().
+        :param level: The index of the level.
+        :param right_hand_side: Numpy array with the net heat flowing into every cell of the level.
+        :return: Numpy array with the correction of every cell of the level.
+        """
+        conductances, diagonal, fixed = levels[level]
+        correction = np.zeros(fixed.shape)
+        if level == len(levels) - 1:
+            # The coarsest level has at most 8 cells, so smoothing alone solves it
+            _smooth(correction, right_hand_side, conductances, diagonal, fixed, 50)
+            return correction
+
+        _smooth(correction, right_hand_side, conductances, diagonal, fixed, self.smoothing_steps)
+        residual = right_hand_side + _apply_operator(correction, conductances)
+        residual[fixed] = 0
+        coarse_correction = self._cycle(levels, level + 1, _sum_blocks(residual))
+        correction += _expand_blocks(coarse_correction, fixed.shape)
+        correction[fixed] = 0
+        _smooth(correction, right_hand_side, conductances, diagonal, fixed, self.smoothing_steps, reverse=True)
+        return correction
+
+
+def _apply_operator(values, conductances):
+    """
+    Computes the net heat flowing into every cell from its neighbours.
+
+    :param values: Numpy array of cell temperatures or corrections (K).
+    :param conductances: The conductances of the faces along each axis.
+    :return: Numpy array with the net heat flowing into every cell.
+    """
+    flows = np.zeros_like(values)
+    for (lower, upper), faces in zip(face_slices(values.ndim), conductances):
+        flow = faces * (values[upper] - values[lower])
+        flows[lower] += flow
+        flows[upper] -= flow
+    return flows
+
+
+def _calculate_diagonal(shape, conductances):
+    """
+    Computes the total conductance of the faces of every cell.
+
+    :param shape: The shape of the level.
+    :param conductances: The conductances of the faces along each axis.
+    :return: Numpy array with the total conductance of every cell, 1 for cells without conducting faces.
+    """
+    diagonal = np.zeros(shape)
+    for (lower, upper), faces in zip(face_slices(len(shape)), conductances):
+        diagonal[lower] += faces
+        diagonal[upper] += faces
+    diagonal[diagonal == 0] = 1
+    return diagonal
+
+
+def _smooth(correction, right_hand_side, conductances, diagonal, fixed, sweeps, reverse=False):
+    """
+    Runs red-black Gauss-Seidel sweeps, updating every free cell to balance the heat flowing in from its neighbours.
+    Cells of one colour only have neighbours of the other colour, so each half sweep is a single vectorized update.
+
+    :param correction: Numpy array of corrections, updated in place.
+    :param right_hand_side: Numpy array with the net heat to balance in every cell.
+    :param conductances: The conductances of the faces along each axis.
+    :param diagonal: The total conductance of the faces of every cell.
+    :param fixed: Boolean numpy array marking the fixed cells, whose correction stays zero.
+    :param sweeps: The number of sweeps.
+    :param reverse: Whether to update the black cells first, which keeps a V-cycle symmetric.
+    """
+    red = np.indices(fixed.shape).sum(axis=0) % 2 == 0
+    colours = (~red & ~fixed, red & ~fixed) if reverse else (red & ~fixed, ~red & ~fixed)
+    for _ in range(sweeps):
+        for colour in colours:
+            neighbours = _apply_operator(correction, conductances) + diagonal * correction
+            correction[colour] = (right_hand_side[colour] + neighbours[colour]) / diagonal[colour]
+
+
+def _sum_blocks(values, skip_axis=None):
+    """
+    Sums 2x2x2 blocks of cells into the cells of the next coarser level. Odd sizes end with a block of one cell.
+
+    :param values: Numpy array to coarsen.
+    :param skip_axis: Optional axis that is left as it is.
+    :return: Numpy array with the sums of the blocks.
+    """
+    padding = [(0, 0 if axis == skip_axis else size % 2) for axis, size in enumerate(values.shape)]
+    values = np.pad(values, padding)
+    for axis in range(values.ndim):
+        if axis != skip_axis:
+            values = np.add.reduceat(values, np.arange(0, values.shape[axis], 2), axis=axis)
+    return values
+
+
+def _expand_blocks(values, shape):
+    """
+    Copies the value of every cell of a coarse level to the 2x2x2 block of cells it covers on the finer level.
+
+    :param values: Numpy array of the coarse level.
+    :param shape: The shape of the finer level.
+    :return: Numpy array with the given shape.
+    """
+    for axis in range(values.ndim):
+        values = np.repeat(values, 2, axis=axis)
+    return values[tuple(slice(size) for size in shape)]
@@ -0,0 +1,43 @@
+from collections import deque
+
+
+class PropagationQueue(deque):
+    """
+    A FIFO queue of cell coordinates used by the Propagator to track a propagation wave.
+
+    It behaves like a deque, but also keeps the set of queued coordinates so that membership checks cost O(1) instead
+    of a scan over the whole queue. The Propagator never queues the same cell twice, so the set always mirrors the
+    queue contents exactly and trajectories are identical to those of a plain deque.
+
+    :param iterable: Optional coordinates to start the queue with.
+    """
+
+    def __init__(self, iterable=()):
+        super().__init__(iterable)
+        self.members = set(self)
+
+    def __contains__(self, cell):
+        return cell in self.members
+
+    def append(self, cell):
+        super().append(cell)
+        self.members.add(cell)
+
+    def popleft(self):
+        cell = super().popleft()
+        self.members.discard(cell)
+        return cell
+
+    def clear(self):
+        super().clear()
+        self.members.clear()
+
+    def merge(self, other):
+        """
+        Appends the cells of another queue that are not already in this one, keeping their order.
+
+        :param other: The queue to merge into this one.
+        """
+        for cell in other:
+            if cell not in self.members:
+                self.append(cell)
@@ -1,7 +1,21 @@
-from collections import deque
+import copy
 import numpy as np
 import random
+from simulation.adi_solver import ADISolver
+from simulation.convergence_tracker import ConvergenceTracker
+from simulation.csr_matrix import CSRMatrix
+from simulation.green_solver import GreenSolver
 from simulation.heat_conductor import HeatConductor
+from simulation.implicit_solver import ImplicitSolver
+from simulation.krylov_solver import KrylovSolver
+from simulation.modal_solver import ModalSolver
+from simulation.multigrid_solver import MultigridSolver
+from simulation.propagation_queue import PropagationQueue
+from simulation.spectral_solver import SpectralSolver
+from simulation.voxel_geometry import VoxelGeometry
+
+# Names of the available propagation engines
+ENGINES = ('queue', 'stencil', 'implicit', 'adi', 'spectral', 'modal', 'krylov', 'green')
 
 
 class Propagator:
@@ -13,7 +27,8 @@ class Propagator:
     The class uses the concept of a grid (numpy array) that represents a 3D environment, where each point in the grid
     symbolizes a point in the 3D domain. Heat is diffused from each point to its neighbours in a random direction.
 
-    :param cube_size: An integer representing the edge length of the cube.
+    :param cube_size: An integer representing the edge length of the cube, or a (nx, ny, nz) tuple with the number
+                      of cells along each axis of a rectangular domain.
     :param origin: A tuple representing the coordinates from which heat propagation starts.
     :param start_temp: An initial temperature at the origin.
     :param end_temp: A final expected temperature at the origin.
@@ -22,6 +37,41 @@ class Propagator:
     :param max_iterations: The maximum number of heat propagation steps to prevent infinite looping.
     :param delta_tolerance: This manages temperature fluctuations within the system for the np.isclose check.
     :param heat_conductor: An instance of the HeatConductor class to handle heat conduction calculations.
+    :param engine: The propagation engine to use. 'queue' walks cells one at a time from propagation queues, 'stencil'
+                   advances the whole cube at once with a vectorized 7-point Laplacian, 'implicit' and 'adi'
+                   advance it with implicit schemes that are stable for any conduction_time, 'spectral' advances
+                   a uniform material exactly in a discrete cosine basis, 'modal' advances any constant material
+                   with its lowest eigenmodes, 'krylov' advances any material with a Krylov approximation of
+                   the matrix exponential, and 'green' computes states_at() of a uniform material by superposing
+                   the heat kernel of every heating pulse.
+    :param max_waves: Optional cap on the number of concurrent propagation waves in the queue engine. When set, waves
+                      whose frontiers overlap are merged into a single frontier, and the oldest waves are merged
+                      together while there are more than max_waves of them. None keeps every wave separate.
+    :param verify_interval: The number of iterations between full np.isclose passes that verify the running count of
+                            cells outside delta_tolerance.
+    :param record_every: Record the state of the cube every Nth propagation step.
+    :param record_frames: Optional fixed number of frames to record, spread evenly over the steps of the run, or over
+                          its simulated time with adaptive time stepping. Between record_frames and twice as many are
+                          kept. When set, it replaces record_every.
+    :param record_threshold: Optional temperature change (K). When set, a selected step is only recorded if the largest
+                             change of any cell since the last recorded frame exceeds it.
+    :param implicit_scheme: The time integration scheme of the implicit engine, 'backward_euler' or 'crank_nicolson'.
+    :param solver_tolerance: The relative residual at which the implicit engine's conjugate-gradient solve stops.
+    :param solver_max_iterations: The maximum number of conjugate-gradient iterations per step of the implicit engine.
+    :param adaptive: Whether the implicit and adi engines adapt their time step instead of always advancing by
+                     conduction_time. The local error of each step is estimated by step doubling.
+    :param error_tolerance: The largest estimated error (K) of any cell accepted for an adaptive step.
+    :param min_time_step: The shortest adaptive time step (seconds). Defaults to conduction_time / 100.
+    :param max_time_step: The longest adaptive time step (seconds). Defaults to conduction_time * 1000.
+    :param modes: The number of eigenmodes of the modal engine.
+    :param modal_cache: Optional directory the eigenmodes of the modal engine are saved to and loaded from, so they
+                        are only computed once per geometry and material set.
+    :param krylov_dimension: The largest Krylov subspace dimension of the krylov engine. Its estimated error is kept
+                             below solver_tolerance.
+    :param mask: Optional boolean numpy array of the cells that belong to the part, for parts that are not a full
+                 cube. The stencil engine then only stores and updates the active cells, see VoxelGeometry. Void cells
+                 keep start_temp in the recorded states.
+    :param operator_cache: Optional directory the conduction matrix of the mask is saved to and loaded from.
 
     Returns:
         A list of numpy arrays representing the cube's state after each step of the propagation.
@@ -29,8 +79,43 @@ class Propagator:
     """
 
     def __init__(self, cube_size=4, origin=(0, 0, 0), start_temp=0, end_temp=1, increment=1, delay=1,
-                 max_iterations=1E4, delta_tolerance=1E-1, heat_conductor=HeatConductor):
+                 max_iterations=1E4, delta_tolerance=1E-1, heat_conductor=HeatConductor, engine='queue',
+                 max_waves=None, verify_interval=1000, record_every=1, record_frames=None, record_threshold=None,
+                 implicit_scheme='backward_euler', solver_tolerance=1E-8, solver_max_iterations=500, adaptive=False,
+                 error_tolerance=1.0, min_time_step=None, max_time_step=None, modes=64, modal_cache=None,
+                 krylov_dimension=30, mask=None, operator_cache=None):
+        shape = tuple(int(size) for size in cube_size) if np.ndim(cube_size) else (int(cube_size),) * 3
+        if engine not in ENGINES:
+            raise ValueError(f"Unknown engine '{engine}', expected one of {ENGINES}")
+        if max_waves is not None and max_waves < 1:
+            raise ValueError("max_waves must be at least 1")
+        if isinstance(heat_conductor, HeatConductor) and engine == 'queue' and (
+                not heat_conductor.uniform or heat_conductor.temperature_dependent):
+            raise ValueError("The queue engine needs a uniform, constant material, use the stencil engine instead")
+        if isinstance(heat_conductor, HeatConductor) and engine in ('spectral', 'green') and (
+                not heat_conductor.uniform or heat_conductor.temperature_dependent):
+            raise ValueError(f"The {engine} engine needs a uniform, constant material, use the modal engine instead")
+        if isinstance(heat_conductor, HeatConductor) and engine == 'modal' and heat_conductor.temperature_dependent:
+            raise ValueError("The modal engine needs a constant material, use the adi engine instead")
+        if isinstance(heat_conductor, HeatConductor) and not heat_conductor.uniform:
+            if heat_conductor.shape != shape:
+                raise ValueError(f"Material shape {heat_conductor.shape} does not match the cube size {shape}")
+        if mask is not None:
+            if engine != 'stencil':
+                raise ValueError("A geometry mask needs the stencil engine")
+            if np.shape(mask) != shape:
+                raise ValueError(f"Mask shape {np.shape(mask)} does not match the cube size {shape}")
+            if not mask[origin]:
+                raise ValueError(f"The origin {origin} is not part of the geometry mask")
+        if adaptive and engine not in ('implicit', 'adi'):
+            raise ValueError("Adaptive time stepping needs an unconditionally stable engine, implicit or adi")
+        if record_every < 1:
+            raise ValueError("record_every must be at least 1")
+        if record_frames is not None and record_frames < 1:
+            raise ValueError("record_frames must be at least 1")
         self.cube_size = cube_size
+        # Number of cells along each axis
+        self.shape = shape
         self.origin = origin
         self.start_temp = start_temp
         self.end_temp = end_temp
@@ -39,8 +124,44 @@ class Propagator:
         self.max_iterations = max_iterations
         self.delta_tolerance = delta_tolerance
         self.heat_conductor = heat_conductor
+        self.engine = engine
+        self.max_waves = max_waves
+        self.verify_interval = verify_interval
+        self.record_every = record_every
+        self.record_frames = record_frames
+        self.record_threshold = record_threshold
+        self.implicit_scheme = implicit_scheme
+        self.solver_tolerance = solver_tolerance
+        self.solver_max_iterations = solver_max_iterations
+        self.adaptive = adaptive
+        self.error_tolerance = error_tolerance
+        self.min_time_step = min_time_step
+        self.max_time_step = max_time_step
+        self.modes = modes
+        self.modal_cache = modal_cache
+        self.krylov_dimension = krylov_dimension
+        self.geometry = VoxelGeometry(mask) if mask is not None else None
+        self.operator_cache = operator_cache
+        # Conduction matrix of the geometry over conduction_time
+        self.operator = None
+
+        # Split each conduction_time of the stencil engine into the fewest sub-steps that keep it stable
+        self.substeps = 1
+        if self.geometry is not None and isinstance(heat_conductor, HeatConductor):
+            self.operator = self.geometry.conduction_matrix(heat_conductor, cache_dir=operator_cache)
+            self.substeps = max(1, int(np.ceil(-self.operator.diagonal().min(initial=0))))
+            print("Stencil sub-steps per conduction_time: ")
+            print(self.substeps)
+        elif engine == 'stencil' and isinstance(heat_conductor, HeatConductor):
+            self.substeps = heat_conductor.calculate_stable_substeps(shape)
+            print("Stencil sub-steps per conduction_time: ")
+            print(self.substeps)
+        # Metrics of the last run, such as the number of cells still outside delta_tolerance
+        self.metrics = {}
+        # Simulated time (seconds) of each state recorded in the last run
+        self.frame_times = []
 
-    def propagate(self):
+    def propagate(self, history=None):
         """
         Method to simulate heat propagation within a 3D cube.
 
@@ -49,25 +170,359 @@ class Propagator:
         or until all positions in the cube reach a near-uniform temperature, within a set tolerance level.
 
         The state of temperature at all points within the 3D cube is recorded after each step, and these states are
-        saved for tracking the heat evolution.
+        saved for tracking the heat evolution. This is a thin wrapper around iter_states().
+
+        :param history: Optional container with an append() method that receives each state, such as a list or a
+                        history writer. A new list is used by default.
+        :return: Returns the history (by default a list of numpy arrays, cube_states), where each state represents the
+        temperatures at all points within the cube after a propagation step.
+        """
+        if history is None:
+            history = []
+
+        state = None
+        states_length = 0
+        for state in self.iter_states():
+            history.append(state)
+            states_length += 1
+        print("Final cube state: ")
+        print(state)
+        print("Cube states length: ")
+        print(states_length)
+        return history
+
+    def solve_steady_state(self):
+        """
+        Solves directly for the final state propagate() approaches, without stepping through the transient.
+
+        The origin is treated as a source held at end_temp and the faces on the edge of the cube stay insulated. The
+        temperatures at which no more heat flows are found with a MultigridSolver, at a cost that does not depend on
+        how many iterations the transient would take. With insulated faces this is a cube at end_temp throughout.
+
+        Its V-cycles are limited by solver_max_iterations and stop at solver_tolerance. The number of cycles and the
+        relative residual after each of them are also reported in metrics['solver_iterations'] and
+        metrics['solver_residuals'].
+
+        :return: A tuple of the steady state cube and a dictionary of diagnostics: the number of V-cycles ('cycles'),
+                 the relative residual after each cycle ('residuals'), the final relative residual ('residual') and
+                 the number of multigrid levels ('levels').
+        """
+        if self.geometry is not None:
+            raise ValueError("The steady-state solver does not support a geometry mask, use propagate() instead")
+        shape = self.shape
+        cube = np.full(shape, self.start_temp, dtype=float)
+        cube[self.origin] = self.end_temp
+        fixed = np.zeros(shape, dtype=bool)
+        fixed[self.origin] = True
+
+        solver = MultigridSolver(self.heat_conductor, tolerance=self.solver_tolerance,
+                                 max_cycles=self.solver_max_iterations)
+        solver.solve(cube, fixed)
+        self.metrics['solver_iterations'] = [solver.cycles]
+        self.metrics['solver_residuals'] = solver.residuals
+        diagnostics = {'cycles': solver.cycles, 'residuals': solver.residuals,
+                       'residual': solver.residuals[-1] if solver.residuals else 0.0, 'levels': solver.levels}
+        print("Steady state cube: ")
+        print(cube)
+        print("Multigrid cycles: ")
+        print(solver.cycles)
+        return cube, diagnostics
+
+    def states_at(self, times):
+        """
+        Computes the state of the cube at arbitrary simulated times directly, without stepping through the
+        iterations in between.
+
+        The cube is advanced analytically over any length of time by the solver of _create_state_solver(): the
+        spectral or modal solver decay its modes, and the Krylov solver evaluates the matrix exponential. The origin
+        heating schedule is superposed as a pulse of increment at the origin every delay * conduction_time seconds,
+        as in the stencil engine, whenever the origin is below end_temp. The jump from the last pulse to each
+        requested time is taken in one go, and only the requested states are transformed back into cubes. Unlike
+        propagate() there is no convergence test, so the heating schedule carries on up to the latest requested
+        time. The times are kept in frame_times. The green engine computes them with _green_states_at() instead, and
+        the krylov engine with _krylov_states_at() unless the properties depend on temperature or its expansion does
+        not converge within krylov_dimension.
+
+        :param times: A sequence of simulated times (seconds).
+        :return: A list of numpy arrays with the state of the cube at each time, in the order of times.
+        """
+        if self.geometry is not None:
+            raise ValueError("states_at() does not support a geometry mask, use propagate() instead")
+        if self.engine == 'green':
+            return self._green_states_at(times)
+        if self.engine == 'krylov' and not self.heat_conductor.temperature_dependent:
+            states = self._krylov_states_at(times)
+            if states is not None:
+                return states
+        shape = self.shape
+        solver = self._create_state_solver(self.heat_conductor)
+        heating_period = self.delay * self.heat_conductor.conduction_time
+
+        cube = np.full(shape, self.start_temp, dtype=float)
+        cube[self.origin] = self.start_temp + self.increment
+        state = solver.transform(cube)
+        # State of a heating pulse, and the values that select the temperature of the origin from a state
+        impulse = np.zeros(shape)
+        impulse[self.origin] = self.increment
+        pulse = solver.transform(impulse)
+        origin_basis = solver.basis_at(self.origin)
+
+        states = {}
+        pulses = 0
+        for time in sorted(set(times)):
+            # Apply every heating pulse before the requested time, each after the decay since the previous one
+            while pulses * heating_period < time:
+                if pulses:
+                    state = solver.advance(state, heating_period)
+                if np.sum(state * origin_basis) < self.end_temp:
+                    state = state + pulse
+                pulses += 1
+            elapsed = time - (pulses - 1) * heating_period if pulses else time
+            states[time] = solver.inverse(solver.advance(state, elapsed))
+
+        self.frame_times = list(times)
+        return [states[time] for time in times]
+
+    def _green_states_at(self, times):
+        """
+        Computes the state of the cube at arbitrary simulated times by superposing the heat kernel of every heating
+        pulse with a GreenSolver, following the same heating schedule as states_at().
+
+        Whether a pulse fires depends on the temperature of the origin, which only depends on the earlier pulses, so
+        the schedule is resolved first from the response of the origin to a single pulse, tabulated once for every
+        multiple of the heating period. Each requested cube is then the sum of the kernels of the pulses before it,
+        computed in one go, so neither costs a cube update per time step.
+
+        :param times: A sequence of simulated times (seconds).
+        :return: A list of numpy arrays with the state of the cube at each time, in the order of times.
+        """
+        solver = GreenSolver(self.heat_conductor, self.shape, self.origin)
+        pulse_times = self._pulse_times(times)
+        fired_times = self._resolve_pulses(self.increment * solver.source_response(pulse_times))
+
+        states = {}
+        for time in set(times):
+            lags = time - fired_times[fired_times < time] if time > 0 else np.zeros(1)
+            states[time] = self.start_temp + self.increment * solver.superpose(lags)
+
+        self.frame_times = list(times)
+        return [states[time] for time in times]
+
+    def _krylov_states_at(self, times):
+        """
+        Computes the state of the cube at arbitrary simulated times by superposing the response of every heating
+        pulse, following the same heating schedule as states_at(), for the krylov engine with constant properties.
+
+        The response to a pulse at the origin is expanded once with KrylovSolver.expand() into Ritz modes that decay
+        on their own, accurate at every multiple of the heating period and every requested time. As for the green
+        engine, the schedule is resolved first from the response of the origin, and each requested cube is then the
+        sum of the responses of the pulses before it. A single Krylov subspace thus replaces one per heating period.
+
+        :param times: A sequence of simulated times (seconds).
+        :return: A list of numpy arrays with the state of the cube at each time, in the order of times, or None if
+                 the expansion did not converge within krylov_dimension.
+        """
+        solver = self._create_state_solver(self.heat_conductor)
+        pulse_times = self._pulse_times(times)
+        impulse = np.zeros(self.shape)
+        impulse[self.origin] = self.increment
+        expansion = solver.expand(impulse, np.concatenate((pulse_times, times)))
+        if expansion is None:
+            return None
+        mean, rates, modes = expansion
+        modes = modes.reshape(len(rates), -1)
+        origin = np.ravel_multi_index(self.origin, self.shape)
+        fired_times = self._resolve_pulses(mean + np.exp(-np.outer(pulse_times, rates)) @ modes[:, origin])
+
+        states = {}
+        for time in set(times):
+            lags = time - fired_times[fired_times < time] if time > 0 else np.zeros(1)
+            # Each mode decays on its own, so the pulses only add up their decay factors
+            decays = np.exp(-np.outer(lags, rates)).sum(axis=0)
+            states[time] = (self.start_temp + len(lags) * mean + decays @ modes).reshape(self.shape)
+
+        self.frame_times = list(times)
+        return [states[time] for time in times]
 
-        :return: Returns a list of numpy arrays (cube_states), where each state represents the temperatures at all
-        points within the cube after a propagation step.
+    def _pulse_times(self, times):
+        """
+        :param times: A sequence of simulated times (seconds).
+        :return: Numpy array with the times of the heating pulses that may fire before the latest of times, every
+                 multiple of delay * conduction_time.
+        """
+        heating_period = self.delay * self.heat_conductor.conduction_time
+        count = int(np.ceil(max(times) / heating_period)) if len(times) else 0
+        return np.arange(count) * heating_period
+
+    def _resolve_pulses(self, origin_response):
+        """
+        Resolves which heating pulses fire: a pulse fires when the origin is below end_temp just before it. The
+        temperature of the origin only depends on the start and the earlier pulses, so it is summed from the response
+        of the origin to a single pulse.
+
+        :param origin_response: Numpy array with the temperature rise of the origin a multiple of the heating period
+                                after a pulse of increment, one per pulse time from _pulse_times().
+        :return: Numpy array with the times of the pulses that fire, starting with the initial pulse at 0 s.
+        """
+        heating_period = self.delay * self.heat_conductor.conduction_time
+        count = len(origin_response)
+        fired = np.zeros(count)
+        for pulse in range(count):
+            # Temperature of the origin just before the pulse, from the start and every earlier pulse
+            origin = self.start_temp + origin_response[pulse] + np.dot(fired[:pulse], origin_response[pulse:0:-1])
+            fired[pulse] = origin < self.end_temp
+        return np.concatenate(([0.0], np.arange(count)[fired > 0] * heating_period))
+
+    def state_at(self, time):
+        """
+        Computes the state of the cube at one simulated time directly, see states_at().
+
+        :param time: A simulated time (seconds).
+        :return: A numpy array with the state of the cube.
+        """
+        return self.states_at([time])[0]
+
+    def _create_state_solver(self, conductor):
+        """
+        Creates the solver that advances the cube over any length of time: a ModalSolver with the lowest eigenmodes
+        of the material for the modal engine, a KrylovSolver for the krylov engine, whose sub-step dimensions and
+        error estimates are reported in metrics['solver_iterations'] and metrics['solver_residuals'], and a
+        SpectralSolver with the cosine modes of a uniform material otherwise. The green engine steps with the
+        SpectralSolver, which advances a cube by the same heat kernel.
+
+        :param conductor: The heat conductor to solve with.
+        :return: A SpectralSolver, ModalSolver or KrylovSolver.
+        """
+        shape = self.shape
+        if self.engine == 'modal':
+            return ModalSolver(conductor, shape, modes=self.modes, cache_dir=self.modal_cache)
+        if self.engine == 'krylov':
+            solver = KrylovSolver(conductor, shape, tolerance=self.solver_tolerance,
+                                  max_dimension=self.krylov_dimension)
+            self.metrics['solver_iterations'] = solver.iterations
+            self.metrics['solver_residuals'] = solver.residuals
+            return solver
+        return SpectralSolver(conductor, shape)
+
+    def iter_states(self):
+        """
+        Simulates heat propagation like propagate(), but yields the state of the cube after each recorded propagation
+        step as soon as it is produced instead of keeping every state in memory.
+
+        Consumers such as file writers or reducers can therefore handle the states one at a time with constant memory.
+        Which steps are recorded is set by record_every, record_frames and record_threshold. The last state of the
+        run is always recorded. The simulated time of each recorded state is kept in frame_times.
+
+        The length of the run is not known in advance, so record_frames records a step every frame_interval steps
+        (or conduction_times of simulated time with adaptive steps), starting at 1. Once twice record_frames states
+        are held, every other one is dropped and frame_interval doubles, as RingHistory does with its keyframes, so
+        the frames stay evenly spread whenever the run stops. These states are only yielded when the run ends.
+
+        :return: A generator of numpy arrays, each a copy of the cube after a recorded propagation step.
+        """
+        if self.engine == 'queue':
+            states = self._iterate_queue()
+        elif self.geometry is not None:
+            states = self._iterate_masked()
+        elif self.adaptive:
+            states = self._iterate_adaptive()
+        else:
+            states = self._iterate_steps(self._create_step())
+
+        self.frame_times = []
+        time = cube = None
+        last_recorded = None
+        recorded = True
+        previous_time = 0.0
+        # States held back for record_frames, with their simulated times
+        frames = []
+        frame_interval = 1
+        for iteration, (time, cube) in enumerate(states, start=1):
+            # Adaptive steps vary in length, so their progress is measured in conduction_times of simulated time
+            progress = None
+            if self.adaptive:
+                conduction_time = self.heat_conductor.conduction_time
+                progress = (previous_time / conduction_time, time / conduction_time)
+            previous_time = time
+            recorded = self._should_record(iteration, cube, last_recorded, progress, frame_interval)
+            if recorded:
+                if self.record_threshold is not None:
+                    last_recorded = cube.copy()
+                if self.record_frames is None:
+                    self.frame_times.append(time)
+                    yield cube.copy()
+                    continue
+                frames.append((time, cube.copy()))
+                if len(frames) == 2 * self.record_frames:
+                    # Drop every other frame to make room, keeping the ones on multiples of the doubled interval
+                    frames = frames[1::2]
+                    frame_interval *= 2
+
+        for frame_time, frame in frames:
+            self.frame_times.append(frame_time)
+            yield frame
+
+        # Always capture the last state of the run
+        if not recorded:
+            self.frame_times.append(time)
+            yield cube.copy()
+
+    def max_frames(self):
+        """
+        Computes the largest number of states iter_states() can yield, for instance to preallocate a history file.
+
+        :return: The maximum number of recorded states, including the last state of the run.
+        """
+        if self.record_frames is not None:
+            return 2 * self.record_frames
+        return int(self.max_iterations) // self.record_every + 1
+
+    def _should_record(self, iteration, cube, last_recorded, progress=None, frame_interval=1):
+        """
+        Decides whether the state of the cube after a propagation step should be recorded.
+
+        :param iteration: The number of the propagation step, starting at 1.
+        :param cube: The state of the cube after the step.
+        :param last_recorded: The last recorded state, only kept when record_threshold is set.
+        :param progress: Optional (before, after) simulated time of the step in conduction_times, for adaptive steps.
+                         record_frames are then spread over simulated time instead of over steps.
+        :param frame_interval: The number of steps, or conduction_times, between the frames of record_frames.
+        :return: True if the state should be recorded.
+        """
+        if self.record_frames is not None:
+            before, after = progress if progress is not None else (iteration - 1, iteration)
+            # Record when the step crosses the next multiple of frame_interval
+            if after // frame_interval == before // frame_interval:
+                return False
+        elif iteration % self.record_every != 0:
+            return False
+
+        if self.record_threshold is not None and last_recorded is not None:
+            return np.max(np.abs(cube - last_recorded)) > self.record_threshold
+        return True
+
+    def _iterate_queue(self):
+        """
+        Runs the queue engine, distributing heat from the origin by walking cells one at a time from propagation
+        queues, each of which pops one cell per iteration.
+
+        :return: A generator yielding the simulated time and the cube itself (not a copy) after each propagation step.
         """
         # Create a 3D numpy array (cube) filled with the starting temperature of every cell
-        cube = np.full((self.cube_size, self.cube_size, self.cube_size), self.start_temp, dtype=float)
-        # Initialize a list that will store the state of the cube at each step of the propagation
-        cube_states = []
+        cube = np.full(self.shape, self.start_temp, dtype=float)
 
         # Define the possible directions of propagation as unit vectors in 3D space
         directions = [(1, 0, 0), (-1, 0, 0), (0, 1, 0), (0, -1, 0), (0, 0, 1), (0, 0, -1)]
 
-        # Initialize a list of deques each containing current points of temperature propagation. Start from the origin.
-        propagation_queues = [deque([self.origin])]
+        # Initialize a list of queues each containing current points of temperature propagation. Start from the origin.
+        propagation_queues = [PropagationQueue([self.origin])]
 
         # Increase the temperature at the origin by the defined increment
         cube[self.origin] = self.start_temp + self.increment
 
+        # Keep a running count of the cells outside delta_tolerance, updated whenever a cell changes
+        tracker = ConvergenceTracker(cube, self.end_temp, self.delta_tolerance, self.verify_interval)
+
         # Initialize the index that keeps track of the number of completed propagation steps
         propagation_index = 0
 
@@ -81,15 +536,19 @@ class Propagator:
             # Increase temperature at origin periodically if origin cube is less than end temp and start new propagation
             if propagation_index % self.delay == 0:
                 if cube[self.origin] < self.end_temp:
-                    cube[self.origin] += self.increment
-                propagation_queues.append(deque([self.origin]))
+                    tracker.add(self.origin, self.increment)
+                propagation_queues.append(PropagationQueue([self.origin]))
 
             # Always add origin to propagation queue when total iterations is less than self.delay
             elif propagation_index < self.delay:
-                propagation_queues.append(deque([self.origin]))
+                propagation_queues.append(PropagationQueue([self.origin]))
+
+            # Merge overlapping waves and keep the number of concurrent waves bounded
+            if self.max_waves is not None:
+                propagation_queues = _coalesce_waves(propagation_queues, self.max_waves)
 
             # Clear queues if we get close to the end_temp
-            if np.all(np.isclose(cube, self.end_temp, rtol=0, atol=self.delta_tolerance)):
+            if tracker.converged():
                 for queue in propagation_queues:
                     queue.clear()
                 break
@@ -111,19 +570,21 @@ class Propagator:
                         nx, ny, nz = x + dx, y + dy, z + dz
 
                         # If the new position is within the cube and lower temperature than the current point
-                        if (0 <= nx < self.cube_size and 0 <= ny < self.cube_size and 0 <= nz < self.cube_size and
+                        if (0 <= nx < self.shape[0] and 0 <= ny < self.shape[1] and 0 <= nz < self.shape[2] and
                                 cube[x, y, z] > cube[nx, ny, nz]):
 
-                            # Calculate the temperature change after heat conduction from heat_conductor
+                            # Calculate the temperature change after heat conduction from heat_conductor, along the
+                            # axis of the direction
                             diff = self.heat_conductor.calculate_temperature_change(
-                                initial_temp=cube[x, y, z], neighbour_temp=cube[nx, ny, nz]
+                                initial_temp=cube[x, y, z], neighbour_temp=cube[nx, ny, nz],
+                                axis=(dy != 0) + 2 * (dz != 0)
                             )
 
                             # If temperature difference is less than 0 and new coordinate is not already in queue
                             if diff < 0 and (nx, ny, nz) not in propagation_queues[i]:
                                 # Update temperatures of new and current position
-                                cube[nx, ny, nz] -= diff
-                                cube[x, y, z] += diff
+                                tracker.add((nx, ny, nz), -diff)
+                                tracker.add((x, y, z), diff)
                                 # Append new point to propagation queue
                                 propagation_queues[i].append((nx, ny, nz))
 
@@ -131,8 +592,8 @@ class Propagator:
                             # already in queue
                             elif diff >= 0 and (x, y, z) not in propagation_queues[i]:
                                 # Update temperatures of new and current position
-                                cube[nx, ny, nz] += diff
-                                cube[x, y, z] -= diff
+                                tracker.add((nx, ny, nz), diff)
+                                tracker.add((x, y, z), -diff)
                                 # Append current point to propagation queue
                                 propagation_queues[i].append((x, y, z))
 
@@ -141,12 +602,258 @@ class Propagator:
                     # Remove it from the batch of propagation_queues
                     propagation_queues.pop(i)
 
-            # Add the state of the current cube to the cube_states list
-            cube_states.append(cube.copy())
+            # Hand over the simulated time and the state of the current cube
+            yield iterations * self.heat_conductor.conduction_time, cube
             # Increment the propagation index
             propagation_index += 1
-        print("Final cube state: ")
-        print(cube_states[-1])
-        print("Cube states length: ")
-        print(len(cube_states))
-        return cube_states
+        self.metrics['unconverged_cells'] = tracker.unconverged_cells
+
+    def _create_step(self, conductor=None):
+        """
+        Creates the function that advances the whole cube over one conduction_time for the vectorized engines.
+
+        The stencil engine applies a 7-point Laplacian over the full cube with HeatConductor.calculate_cube_changes():
+        the heat crossing every face between two adjacent cells is computed in one call from the same coefficients as
+        the queue engine (k, c_p, rho, the spacing, a and conduction_time). The implicit engine solves for the new
+        temperatures with an ImplicitSolver, whose conjugate-gradient iterations and residuals of every step are
+        reported in metrics['solver_iterations'] and metrics['solver_residuals']. The adi engine solves for them one
+        axis at a time with an ADISolver. The spectral, modal, krylov and green engines advance it with the solvers of
+        _create_state_solver().
+
+        When conduction_time is above the stability limit of the stencil engine, each step is split into
+        self.substeps sub-steps, applied with a copy of the heat conductor whose coefficients were computed once for
+        the shorter conduction_time.
+
+        :param conductor: Optional heat conductor to step with instead of self.heat_conductor.
+        :return: A function taking the cube and updating it in place.
+        """
+        if conductor is None:
+            conductor = self.heat_conductor
+        if self.engine == 'implicit':
+            solver = ImplicitSolver(conductor, scheme=self.implicit_scheme, tolerance=self.solver_tolerance,
+                                    max_iterations=self.solver_max_iterations)
+            self.metrics['solver_iterations'] = solver.iterations
+            self.metrics['solver_residuals'] = solver.residuals
+            return solver.step
+        if self.engine == 'adi':
+            return ADISolver(conductor).step
+        if self.engine in ('spectral', 'modal', 'krylov', 'green'):
+            return self._create_state_solver(conductor).step
+
+        if self.substeps > 1:
+            conductor = copy.copy(self.heat_conductor)
+            conductor.conduction_time = self.heat_conductor.conduction_time / self.substeps
+
+        def stencil_step(cube):
+            for _ in range(self.substeps):
+                cube += conductor.calculate_cube_changes(cube)
+        return stencil_step
+
+    def _iterate_steps(self, step):
+        """
+        Runs a vectorized engine, advancing the whole cube one time step at a time with the given step function.
+        Faces on the edge of the cube are insulated. The origin is heated on the same schedule as the queue engine,
+        and the run stops on the same convergence test.
+
+        :param step: A function taking the cube and advancing it in place over one conduction_time.
+        :return: A generator yielding the simulated time and the cube itself (not a copy) after each propagation step.
+        """
+        cube = np.full(self.shape, self.start_temp, dtype=float)
+
+        cube[self.origin] = self.start_temp + self.increment
+        tracker = ConvergenceTracker(cube, self.end_temp, self.delta_tolerance, self.verify_interval)
+
+        propagation_index = 0
+        iterations = 0
+
+        while iterations < self.max_iterations:
+
+            iterations += 1
+            # Increase temperature at origin periodically if origin cube is less than end temp
+            if propagation_index % self.delay == 0 and cube[self.origin] < self.end_temp:
+                tracker.add(self.origin, self.increment)
+
+            # Stop if we get close to the end_temp
+            if tracker.converged():
+                break
+
+            # Every cell may change in a step, so the running count is refreshed with a full pass
+            step(cube)
+            tracker.unconverged_cells = tracker.count()
+
+            yield iterations * self.heat_conductor.conduction_time, cube
+            propagation_index += 1
+        self.metrics['unconverged_cells'] = tracker.unconverged_cells
+
+    def _iterate_masked(self):
+        """
+        Runs the stencil engine on the active cells of the geometry mask only. Their temperatures are kept in a
+        vector and advanced with the conduction matrix of VoxelGeometry.conduction_matrix(), built once over
+        conduction_time, or loaded from operator_cache, and scaled to the sub-step. The matrix has no min_delta
+        dead-band, so energy is conserved exactly. The origin is heated on the same schedule and the run stops on the
+        same convergence test as _iterate_steps(), over the active cells.
+
+        :return: A generator yielding the simulated time and the cube (not a copy) after each propagation step, with
+                 start_temp in the void cells.
+        """
+        operator = self.operator
+        if operator is None:
+            operator = self.geometry.conduction_matrix(self.heat_conductor, cache_dir=self.operator_cache)
+        # The temperature changes are proportional to the time step, so the matrix of a sub-step is a scaled copy
+        matrix = CSRMatrix(operator.data / self.substeps, operator.indices, operator.indptr)
+
+        cube = np.full(self.geometry.shape, self.start_temp, dtype=float)
+        temperatures = np.full(self.geometry.size, self.start_temp, dtype=float)
+        origin = (self.geometry.number(self.origin),)
+        temperatures[origin] = self.start_temp + self.increment
+        tracker = ConvergenceTracker(temperatures, self.end_temp, self.delta_tolerance, self.verify_interval)
+
+        propagation_index = 0
+        iterations = 0
+
+        while iterations < self.max_iterations:
+
+            iterations += 1
+            # Increase temperature at origin periodically if origin cell is less than end temp
+            if propagation_index % self.delay == 0 and temperatures[origin] < self.end_temp:
+                tracker.add(origin, self.increment)
+
+            # Stop if we get close to the end_temp
+            if tracker.converged():
+                break
+
+            for _ in range(self.substeps):
+                temperatures += matrix.dot(temperatures)
+            tracker.unconverged_cells = tracker.count()
+
+            yield iterations * self.heat_conductor.conduction_time, self.geometry.expand(temperatures, out=cube)
+            propagation_index += 1
+        self.metrics['unconverged_cells'] = tracker.unconverged_cells
+
+    def _iterate_adaptive(self):
+        """
+        Runs the implicit or adi engine with adaptive time stepping. Every iteration advances the cube by a time step
+        between min_time_step and max_time_step instead of by conduction_time.
+
+        The local error of a step is estimated by step doubling: the step is taken once in full and once as two half
+        steps, and the largest difference between the two results is the error estimate. Steps with an error above
+        error_tolerance are retried with a shorter time step, and the time step grows again as the cube smooths out.
+        The origin is heated at the same average rate as the fixed schedule, increment every delay * conduction_time
+        seconds, at the start of each (half) step while it is below end_temp. The heating is therefore part of the
+        error estimate. The time steps taken are reported in metrics['time_steps']. For the implicit engine, the
+        conjugate-gradient iterations and residuals of the full steps are reported in metrics['solver_iterations'] and
+        metrics['solver_residuals'], and those of the half steps in metrics['half_solver_iterations'] and
+        metrics['half_solver_residuals'].
+
+        :return: A generator yielding the simulated time and the cube itself (not a copy) after each propagation step.
+        """
+        conduction_time = self.heat_conductor.conduction_time
+        min_time_step = self.min_time_step or conduction_time / 100
+        max_time_step = self.max_time_step or conduction_time * 1000
+        heating_period = self.delay * conduction_time
+
+        # One heat conductor and engine each for the full and the half steps, so that their coefficients are only
+        # recomputed when the time step changes
+        full_conductor = copy.copy(self.heat_conductor)
+        half_conductor = copy.copy(self.heat_conductor)
+        full_step = self._create_step(full_conductor)
+        full_metrics = dict(self.metrics)
+        half_step = self._create_step(half_conductor)
+        # The solver of the half steps took over the solver metrics, so report them separately from the full steps
+        for key in ('solver_iterations', 'solver_residuals'):
+            if key in full_metrics:
+                self.metrics['half_' + key] = self.metrics[key]
+                self.metrics[key] = full_metrics[key]
+
+        # The local error of backward Euler (including the locally one-dimensional adi scheme) grows with the square
+        # of the time step, and the local error of Crank-Nicolson with its cube
+        order = 3 if self.engine == 'implicit' and self.implicit_scheme == 'crank_nicolson' else 2
+
+        def heat_and_step(state, step, duration):
+            # Heat the origin with the energy the schedule delivers over the duration if it is less than end temp
+            if state[self.origin] < self.end_temp:
+                state[self.origin] += self.increment * duration / heating_period
+            step(state)
+
+        cube = np.full(self.shape, self.start_temp, dtype=float)
+        cube[self.origin] = self.start_temp + self.increment
+        tracker = ConvergenceTracker(cube, self.end_temp, self.delta_tolerance, self.verify_interval)
+        self.metrics['time_steps'] = time_steps = []
+
+        time = 0.0
+        time_step = conduction_time
+        iterations = 0
+
+        while iterations < self.max_iterations:
+
+            iterations += 1
+            # Stop if we get close to the end_temp
+            if tracker.converged():
+                break
+
+            while True:
+                full_conductor.conduction_time = time_step
+                half_conductor.conduction_time = time_step / 2
+                full = cube.copy()
+                heat_and_step(full, full_step, time_step)
+                half = cube.copy()
+                heat_and_step(half, half_step, time_step / 2)
+                heat_and_step(half, half_step, time_step / 2)
+                error = np.max(np.abs(full - half))
+                if error <= self.error_tolerance or time_step <= min_time_step:
+                    break
+                shrink = max(0.2, 0.9 * (self.error_tolerance / error) ** (1 / order))
+                time_step = max(min_time_step, time_step * shrink)
+
+            cube[...] = half
+            time += time_step
+            time_steps.append(time_step)
+            tracker.unconverged_cells = tracker.count()
+
+            yield time, cube
+            # Grow the time step towards the error tolerance, given the order of the local error
+            growth = 5 if error == 0 else min(5, 0.9 * (self.error_tolerance / error) ** (1 / order))
+            time_step = min(max_time_step, max(min_time_step, time_step * growth))
+        self.metrics['unconverged_cells'] = tracker.unconverged_cells
+
+
+def _coalesce_waves(propagation_queues, max_waves):
+    """
+    Merges propagation waves whose frontiers overlap, then merges the oldest waves together until at most max_waves
+    remain. Waves are kept oldest first, and a merged wave keeps the position of the oldest wave it contains.
+
+    The cost is proportional to the number of queued cells rather than to the number of elapsed iterations.
+
+    :param propagation_queues: List of PropagationQueue instances, oldest first.
+    :param max_waves: The maximum number of waves to keep.
+    :return: The coalesced list of PropagationQueue instances.
+    """
+    # Union-find over wave indices, so that chains of overlapping waves end up in the oldest wave of the chain
+    parents = list(range(len(propagation_queues)))
+
+    def find(index):
+        while parents[index] != index:
+            parents[index] = parents[parents[index]]
+            index = parents[index]
+        return index
+
+    # Map of each queued cell to the first wave that holds it
+    owners = {}
+    for index, queue in enumerate(propagation_queues):
+        for cell in queue:
+            owner = owners.setdefault(cell, index)
+            if owner != index:
+                root, other = sorted((find(owner), find(index)))
+                parents[other] = root
+
+    merged = []
+    for index, queue in enumerate(propagation_queues):
+        root = find(index)
+        if root == index:
+            merged.append(queue)
+        else:
+            propagation_queues[root].merge(queue)
+
+    while len(merged) > max_waves:
+        merged[0].merge(merged.pop(1))
+    return merged
@@ -0,0 +1,42 @@
+import numpy as np
+
+
+class PropertyTable:
+    """
+    The PropertyTable class evaluates a temperature-dependent material property, such as k(T) or c_p(T), for a whole
+    cube at once.
+
+    The tabulated curve is resampled once into a dense, evenly spaced lookup table over [low, high]. Evaluating the
+    property is then a vectorized index-and-lerp into that table, with no per-cell Python calls. Temperatures outside
+    [low, high] take the value at the nearest end of the table.
+
+    :param curve: A sequence of (temperature, value) pairs, sorted by temperature.
+    :param low: The lowest temperature of the lookup table (K).
+    :param high: The highest temperature of the lookup table (K).
+    :param size: The number of entries in the lookup table.
+    """
+
+    def __init__(self, curve, low, high, size=1024):
+        if high <= low:
+            raise ValueError("high must be greater than low")
+        if size < 2:
+            raise ValueError("size must be at least 2")
+        curve = np.asarray(curve, dtype=float)
+        self.low = low
+        self.high = high
+        self.size = size
+        self.scale = (size - 1) / (high - low)
+        self.values = np.interp(np.linspace(low, high, size), curve[:, 0], curve[:, 1])
+        # Slope to the next entry, so a lookup needs a single gather per table
+        self.slopes = np.append(np.diff(self.values), 0)
+
+    def __call__(self, temps):
+        """
+        Evaluates the property at the given temperatures.
+
+        :param temps: Numpy array of temperatures (K).
+        :return: Numpy array of property values with the same shape.
+        """
+        position = np.clip((temps - self.low) * self.scale, 0, self.size - 1)
+        index = position.astype(np.intp)
+        return self.values[index] + (position - index) * self.slopes[index]
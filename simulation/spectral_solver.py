@@ -0,0 +1,127 @@
+import numpy as np
+from simulation.heat_conductor import HeatConductor
+
+
+class SpectralSolver:
+    """
+    The SpectralSolver class advances a cube of a uniform, constant material analytically over any length of time.
+
+    With insulated faces, the conduction operator of HeatConductor.calculate_cube_changes() is diagonalized by the
+    discrete cosine transform (DCT-II) along each axis: every cosine mode decays on its own as exp(-λ·t), with λ the
+    diffusion rate of each axis times 2 - 2·cos(π·m/n) summed over the axes. A cube is transformed once, each mode
+    multiplied by its decay, and transformed back, at O(N log N) cost whatever the time. The transforms are computed
+    with numpy's real FFT of the mirrored cube. Unlike the stencil engine the solver has no min_delta dead-band.
+
+    :param heat_conductor: An instance of the HeatConductor class with a uniform, constant material.
+    :param shape: The shape of the cube.
+    """
+
+    def __init__(self, heat_conductor=HeatConductor, shape=(4, 4, 4)):
+        if not heat_conductor.uniform or heat_conductor.temperature_dependent:
+            raise ValueError("The spectral solver needs a uniform, constant material")
+        self.heat_conductor = heat_conductor
+        self.shape = tuple(shape)
+        # Decay rate of every mode (1/s), from the diffusion rate across one face along each axis
+        self.decay_rates = np.zeros(self.shape)
+        for axis, size in enumerate(self.shape):
+            axis_shape = [1] * len(self.shape)
+            axis_shape[axis] = size
+            rate = heat_conductor.axis_diffusion_numbers[axis] / heat_conductor.conduction_time
+            self.decay_rates = self.decay_rates + rate * (2 - 2 * np.cos(np.pi * np.arange(size) / size)).reshape(
+                axis_shape)
+        self.step_decay = self.decay(heat_conductor.conduction_time)
+
+    def decay(self, duration):
+        """
+        :param duration: A length of simulated time (seconds).
+        :return: Numpy array with the factor every mode decays by over the duration.
+        """
+        return np.exp(-self.decay_rates * duration)
+
+    def advance(self, modes, duration):
+        """
+        :param modes: Numpy array of mode amplitudes.
+        :param duration: A length of simulated time (seconds).
+        :return: Numpy array with the mode amplitudes after the duration.
+        """
+        return modes * self.decay(duration)
+
+    def step(self, cube):
+        """
+        Advances the cube over one conduction_time.
+
+        :param cube: 3D numpy array of cell temperatures (K). It is updated in place.
+        :return: The updated cube.
+        """
+        cube[...] = self.inverse(self.transform(cube) * self.step_decay)
+        return cube
+
+    def basis_at(self, index):
+        """
+        :param index: The index of a cell.
+        :return: Numpy array with the value of every mode at the cell, so that the temperature of the cell is the sum
+                 of the mode amplitudes times these values.
+        """
+        impulse = np.zeros(self.shape)
+        impulse[index] = 1
+        # The transform is orthonormal, so the basis values at a cell are the modes of a unit impulse there
+        return self.transform(impulse)
+
+    def transform(self, cube):
+        """
+        Computes the modes of a cube with an orthonormal DCT-II along every axis.
+
+        :param cube: Numpy array of cell temperatures (K).
+        :return: Numpy array of mode amplitudes with the same shape.
+        """
+        modes = np.asarray(cube, dtype=float)
+        for axis in range(modes.ndim):
+            modes = _dct(modes, axis)
+        return modes
+
+    def inverse(self, modes):
+        """
+        Computes the cube of given modes with an orthonormal DCT-III along every axis, the inverse of transform().
+
+        :param modes: Numpy array of mode amplitudes.
+        :return: Numpy array of cell temperatures (K) with the same shape.
+        """
+        for axis in range(modes.ndim):
+            modes = _inverse_dct(modes, axis)
+        return modes
+
+
+def _dct(values, axis):
+    """
+    Computes the orthonormal DCT-II of an array along one axis from the real FFT of the array followed by its mirror
+    image.
+
+    :param values: Numpy array to transform.
+    :param axis: The axis to transform along.
+    :return: Numpy array with the transform.
+    """
+    size = values.shape[axis]
+    mirrored = np.concatenate((values, np.flip(values, axis=axis)), axis=axis)
+    spectrum = np.moveaxis(np.fft.rfft(mirrored, axis=axis), axis, -1)[..., :size]
+    k = np.arange(size)
+    result = np.real(spectrum * np.exp(-1j * np.pi * k / (2 * size)))
+    scale = np.full(size, np.sqrt(1 / (2 * size)))
+    scale[0] = np.sqrt(1 / (4 * size))
+    return np.moveaxis(result * scale, -1, axis)
+
+
+def _inverse_dct(values, axis):
+    """
+    Computes the orthonormal DCT-III of an array along one axis, the inverse of _dct(), with an inverse real FFT.
+
+    :param values: Numpy array to transform.
+    :param axis: The axis to transform along.
+    :return: Numpy array with the transform.
+    """
+    size = values.shape[axis]
+    k = np.arange(size)
+    weights = np.full(size, np.sqrt(2 / size))
+    weights[0] = 2 * np.sqrt(1 / size)
+    spectrum = np.moveaxis(values, axis, -1) * weights * np.exp(1j * np.pi * k / (2 * size))
+    result = size * np.fft.irfft(spectrum, n=2 * size, axis=-1)[..., :size]
+    return np.moveaxis(result, -1, axis)
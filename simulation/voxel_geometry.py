@@ -0,0 +1,112 @@
+import hashlib
+import os
+import numpy as np
+from simulation.csr_matrix import CSRMatrix
+from simulation.heat_conductor import HeatConductor, face_slices
+
+
+class VoxelGeometry:
+    """
+    The VoxelGeometry class describes a part of any shape as a boolean voxel mask over its bounding box, and numbers
+    its active cells contiguously so that the state of the part is a vector with one temperature per active cell.
+
+    Void cells take no part in the conduction: faces between an active cell and a void cell, like the faces on the
+    edge of the box, are insulated. The conduction operator of HeatConductor.calculate_cube_changes() restricted to
+    the active cells is built as a CSRMatrix, so a time step costs O(active cells) instead of O(box).
+
+    :param mask: Boolean numpy array, True for the cells that belong to the part.
+    """
+
+    def __init__(self, mask):
+        self.mask = np.asarray(mask, dtype=bool)
+        self.shape = self.mask.shape
+        self.size = int(np.count_nonzero(self.mask))
+        # Number of every active cell in the vector, -1 for void cells
+        self.numbers = np.full(self.shape, -1, dtype=np.int64)
+        self.numbers[self.mask] = np.arange(self.size)
+
+    def number(self, index):
+        """
+        :param index: The index of a cell in the box.
+        :return: The number of the cell in the vector.
+        """
+        number = int(self.numbers[index])
+        if number < 0:
+            raise ValueError(f"Cell {index} is not part of the geometry")
+        return number
+
+    def compress(self, cube):
+        """
+        :param cube: Numpy array over the box.
+        :return: Numpy array with the values of the active cells.
+        """
+        return cube[self.mask]
+
+    def expand(self, vector, fill_value=0, out=None):
+        """
+        :param vector: Numpy array with one value per active cell.
+        :param fill_value: The value of void cells.
+        :param out: Optional numpy array over the box to write into. Its void cells are left as they are.
+        :return: Numpy array over the box.
+        """
+        if out is None:
+            out = np.full(self.shape, fill_value, dtype=np.asarray(vector).dtype)
+        out[self.mask] = vector
+        return out
+
+    def cache_key(self, heat_conductor):
+        """
+        :param heat_conductor: The heat conductor of the part.
+        :return: A digest of everything the conduction matrix depends on: the mask and the coefficients of the heat
+                 conductor.
+        """
+        h = heat_conductor
+        digest = hashlib.sha1(repr((self.shape, h.a, h.spacing, h.conduction_time)).encode())
+        digest.update(np.packbits(self.mask).tobytes())
+        for value in (h.k, h.c_p, h.rho):
+            digest.update(np.ascontiguousarray(value, dtype=float).tobytes())
+            digest.update(repr(np.shape(value)).encode())
+        return digest.hexdigest()
+
+    def conduction_matrix(self, heat_conductor=HeatConductor, cache_dir=None):
+        """
+        Builds the matrix of the temperature changes of the active cells over one conduction_time, the operator of
+        HeatConductor.calculate_cube_changes() without the min_delta dead-band. It only depends on the mask and the
+        material, so it is saved to cache_dir and loaded from there by later runs of the same part.
+
+        :param heat_conductor: An instance of the HeatConductor class with properties that do not depend on
+                               temperature.
+        :param cache_dir: Optional directory the matrix is saved to and loaded from.
+        :return: A CSRMatrix with one row and column per active cell.
+        """
+        if heat_conductor.temperature_dependent:
+            raise ValueError("The conduction matrix needs properties that do not depend on temperature")
+        filename = None
+        if cache_dir is not None:
+            filename = os.path.join(cache_dir, f'operator_{self.cache_key(heat_conductor)}.npz')
+            if os.path.exists(filename):
+                return CSRMatrix.load(filename)
+
+        rows, columns, values = [], [], []
+        face_numbers = heat_conductor.get_face_numbers(None)
+        for axis, (lower, upper) in enumerate(face_slices(len(self.shape))):
+            # Faces between two active cells
+            active = self.mask[lower] & self.mask[upper]
+            lower_cells = self.numbers[lower][active]
+            upper_cells = self.numbers[upper][active]
+            if face_numbers:
+                lower_numbers = face_numbers[axis][0][active]
+                upper_numbers = face_numbers[axis][1][active]
+            else:
+                lower_numbers = upper_numbers = np.full(len(lower_cells), heat_conductor.axis_diffusion_numbers[axis])
+            # Each face pulls the lower cell towards the upper one and the other way around
+            rows += [lower_cells, lower_cells, upper_cells, upper_cells]
+            columns += [upper_cells, lower_cells, lower_cells, upper_cells]
+            values += [lower_numbers, -lower_numbers, upper_numbers, -upper_numbers]
+
+        matrix = CSRMatrix.from_coordinates(np.concatenate(rows), np.concatenate(columns), np.concatenate(values),
+                                            self.size)
+        if filename is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+            matrix.save(filename)
+        return matrix
@@ -3,6 +3,8 @@ from matplotlib.animation import FuncAnimation
 import matplotlib.cm as cm
 from matplotlib.ticker import MaxNLocator
 import numpy as np
+from history.memmap_history import MemmapHistory
+from history.quantized_history import QuantizedHistory
 
 
 class Animator:
@@ -13,16 +15,30 @@ class Animator:
     :param start_value: The floor of the range of scalar values for the colormap.
     :param end_value: The ceiling of the range of scalar values for the colormap.
     :param interval: Delay between frames in milliseconds. Default is 100.
+    :param times: Optional simulated time of each state, such as Propagator.frame_times. When given, the animation
+                  plays at a uniform rate of simulated time, showing the latest state at each point in time.
+    :param mask: Optional boolean numpy array of the cells to draw, such as the geometry mask of the Propagator.
+    :param spacing: Optional length of a cell along each axis, such as HeatConductor.spacing, so that rectangular
+                    domains and cells are drawn in proportion.
     """
 
     # Initialization method to set up parameters for the animation
-    def __init__(self, data, start_value, end_value, interval=100):
+    def __init__(self, data, start_value, end_value, interval=100, times=None, mask=None, spacing=None):
         self.data = data
         self.start_value = start_value
         self.end_value = end_value
         self.interval = interval
+        self.times = times
+        self.mask = mask
+        self.spacing = spacing
         self.fig = None
 
+    # Method to create an animator that reads the states from a history file without loading it fully
+    @classmethod
+    def from_file(cls, filename, start_value, end_value, interval=100, times=None, mask=None, spacing=None):
+        return cls(MemmapHistory(filename), start_value, end_value, interval=interval, times=times, mask=mask,
+                   spacing=spacing)
+
     # Method to create the 3D plot, animate it, and save the animation as a video
     def plot(self):
         self.fig = plt.figure()
@@ -35,15 +51,29 @@ class Animator:
     # Method to update the frames for the animation
     def update_plot(self, frame):
         self.ax.cla()
-        cube_state = self.data[frame]
-        filled = np.ones(cube_state.shape, dtype=bool)
+        title = f'Time Step: {frame}'
+        if self.times is not None:
+            # Show the latest state at evenly spaced points of simulated time
+            time = self.times[0] + (self.times[-1] - self.times[0]) * frame / max(len(self.data) - 1, 1)
+            frame = max(int(np.searchsorted(self.times, time, side='right')) - 1, 0)
+            title = f'Time: {time:.4g} s'
+        if isinstance(self.data, QuantizedHistory):
+            # Quantized states index the colormap directly, without converting them back to temperatures
+            cube_state = self.data.codes(frame)
+            colors = cm.turbo(self.data.color_indices(frame, cm.turbo.N))
+        else:
+            cube_state = self.data[frame]
+            colors = cm.turbo((cube_state - self.start_value) / (self.end_value - self.start_value))
+        # Only draw the cells of the part
+        filled = self.mask if self.mask is not None else np.ones(cube_state.shape, dtype=bool)
 
-        colors = cm.turbo((cube_state - self.start_value) / (self.end_value - self.start_value))
         self.ax.voxels(filled, facecolors=colors, edgecolor='k')
 
         self.ax.set_xlim(0, cube_state.shape[0])
         self.ax.set_ylim(0, cube_state.shape[1])
         self.ax.set_zlim(0, cube_state.shape[2])
+        # Scale the axes to the extent of the domain along each of them
+        self.ax.set_box_aspect(np.multiply(cube_state.shape, self.spacing if self.spacing is not None else 1))
 
         self.ax.xaxis.set_major_locator(MaxNLocator(integer=True))
         self.ax.yaxis.set_major_locator(MaxNLocator(integer=True))
@@ -52,4 +82,4 @@ class Animator:
         self.ax.set_xlabel('X')
         self.ax.set_ylabel('Y')
         self.ax.set_zlabel('Z')
-        plt.title(f'Time Step: {frame}')
+        plt.title(title)